@@ -0,0 +1,5 @@
+SECRET_KEY = 'x'
+SQLALCHEMY_DATABASE_URI = 'sqlite:////tmp/h/summon.db'
+GITHUB_API_TOKEN = None
+GITHUB_SECRET = 'secret'
+RELEASE_SYNC_INTERVAL = 0.2
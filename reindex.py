@@ -1,8 +1,36 @@
 #!/usr/bin/env python3
 # SPDX-License-Identifier: BSD-3-Clause
-from summon import app, db
-from summon.github import GitHubAPI
+from argparse import ArgumentParser
+from pathlib import Path
+
+from summon import app, db, gitHubAPI as github, releasesChanged
+from summon.snapshot import writeSnapshot
+from summon.webhooks import WebhookQueue
+
+parser = ArgumentParser(description = 'Re-index the Black Magic Debug releases into the summon database')
+parser.add_argument(
+	'--snapshot', type = Path, metavar = 'DIR',
+	help = 'write a static snapshot of metadata.json and its precompressed forms into DIR for direct serving'
+)
+parser.add_argument(
+	'--skip-sync', action = 'store_true', help = 'do not sync the index with GitHub, only write the snapshot'
+)
+parser.add_argument(
+	'--full', action = 'store_true',
+	help = 'reconcile against the complete list of releases rather than only those newer than the last sync'
+)
+parser.add_argument(
+	'--drain-webhooks', action = 'store_true',
+	help = 'process any queued release webhook notifications that are due, rather than leaving them to the server'
+)
+args = parser.parse_args()
 
-github = GitHubAPI(app.config['GITHUB_API_TOKEN'])
 with app.app_context():
-		github.updateReleases(db)
+	# If the sync or the webhooks indexed anything new, make sure the workers serving the metadata see that, and
+	# that any static snapshot of it being served is brought up to date
+	if not args.skip_sync and github.updateReleases(db, full = args.full):
+		releasesChanged()
+	if args.drain_webhooks:
+		WebhookQueue(app, db, github, releasesChanged).drain()
+	if args.snapshot is not None:
+		writeSnapshot(db, args.snapshot)
@@ -1,33 +1,94 @@
 # SPDX-License-Identifier: BSD-3-Clause
-from flask import Flask, render_template, request
+from flask import Flask, abort, render_template, request
+from werkzeug.datastructures import MultiDict
+from sqlalchemy import sql
+from pathlib import Path
+from urllib.parse import urlencode
+from typing import Any
+from collections.abc import Callable
+import fcntl
+import os
 
-from .models import db
-from .metadata import releasesToJSON
+from .models import db, migrateSchema, SyncState
+from .metadata import metadataToJSON
 from .github import GitHubAPI
 from .etag import ETagCache
+from .snapshot import writeSnapshot
+from .sync import ReleaseSync
+from .webhooks import WebhookQueue
+from .types import Probe, TargetOS, TargetArch
+from .version import canonicalVersion
 
 __all__ = (
 	'app',
+	'releaseSync',
 )
 
 # Initialise Flask for summon
 app = Flask(__name__, instance_relative_config = True)
-# Configure Flask from the config.py in this directory
-app.config.from_pyfile('config.py')
+# Configure Flask from the config.py in this directory, unless pointed at another one (such as for the tests)
+app.config.from_pyfile(os.environ.get('SUMMON_CONFIG', 'config.py'))
+# Keep JSON objects in the order they were built in, rather than having Flask sort them by key, so the releases
+# in the metadata reach clients newest first rather than sorted as strings (with v1.10.0 before v1.9.0)
+app.json.sort_keys = False
 # Now initialise the database engine
 db.init_app(app)
 
 # Create an instance of the GitHub API interactor
-gitHubAPI = GitHubAPI(app.config['GITHUB_API_TOKEN'])
-# Create an instance of the ETag cache
-cache = ETagCache()
+gitHubAPI = GitHubAPI(
+	app.config['GITHUB_API_TOKEN'],
+	connectTimeout = app.config.get('GITHUB_CONNECT_TIMEOUT', 10),
+	readTimeout = app.config.get('GITHUB_READ_TIMEOUT', 60),
+	maxRetries = app.config.get('GITHUB_MAX_RETRIES', 5),
+	downloadChunkSize = app.config.get('DOWNLOAD_CHUNK_SIZE', 64 * 1024),
+	rateLimitReserve = app.config.get('GITHUB_RATE_LIMIT_RESERVE', 50),
+	maxRateLimitWait = app.config.get('GITHUB_MAX_RATE_LIMIT_WAIT', 60),
+)
+# Create an instance of the ETag cache, shared between all the workers via a store in the instance directory
+cache = ETagCache(Path(app.instance_path) / app.config.get('ETAG_CACHE_PATH', 'etag-cache.sqlite'))
 
-# And make sure that all tables are properly defined in the database
-with app.app_context():
+# And make sure that all tables are properly defined in the database, and those that already existed are up to date.
+# Every worker does this as it comes up, so they take turns at it via a lock file - otherwise several starting at
+# once against an older database would all try to make the same changes to it, and all but the first would fail
+migrationLockPath = Path(app.instance_path) / app.config.get('MIGRATION_LOCK_PATH', 'migration.lock')
+with app.app_context(), migrationLockPath.open('a') as migrationLock:
+	fcntl.flock(migrationLock, fcntl.LOCK_EX)
 	db.create_all()
-	# Having done this, also go poke the releases and populate the database with any changes
-	# that may have happened while we were down
-	gitHubAPI.updateReleases(db)
+	migrateSchema(db)
+
+# Invalidate all the cache entries built from the release index. If we know which releases changed, only
+# the per-release cache entries for those need invalidating
+def invalidateReleases(versions: set[str] | None = None):
+	for handlerName in cache.handlers:
+		if handlerName == 'release' and versions is not None:
+			for version in versions:
+				cache.invalidate(handlerName = handlerName, prefix = urlencode({'version': version}))
+		else:
+			cache.invalidate(handlerName = handlerName)
+
+# Once the release index has changed, make sure everything serving metadata from it catches up
+def releasesChanged(versions: set[str] | None = None):
+	invalidateReleases(versions)
+	# Get the entries rebuilt straight away rather than on the next request for them
+	for handlerName in cache.handlers:
+		cache.warm(handlerName = handlerName)
+	# If the metadata is also being published as a static snapshot for the front-end server, refresh that
+	snapshotPath = app.config.get('METADATA_SNAPSHOT_PATH')
+	if snapshotPath is not None:
+		writeSnapshot(db, Path(snapshotPath))
+
+# Release webhook notifications get queued up to be processed in the background by the release sync job
+webhookQueue = WebhookQueue(app, db, gitHubAPI, releasesChanged)
+
+# Having done this, set up the background job that goes and pokes the releases and populates the database
+# with any changes - both those that may have happened while we were down, and any webhooks we missed.
+# Only one worker (whichever holds the lock) does this, so the rest come up and serve the existing index
+# immediately. This gets started by the WSGI entry point so that merely importing summon does no network I/O
+releaseSync = ReleaseSync(
+	app, db, gitHubAPI, Path(app.instance_path) / app.config.get('RELEASE_SYNC_LOCK_PATH', 'release-sync.lock'),
+	app.config.get('RELEASE_SYNC_INTERVAL', 3600), app.config.get('RELEASE_RECONCILE_INTERVAL', 86400),
+	webhookQueue, app.config.get('WEBHOOK_POLL_INTERVAL', 5), releasesChanged
+)
 
 # Register `db` to the Flask globals context for use in templates etc
 @app.before_request
@@ -40,15 +101,98 @@ def build_up():
 def index():
 	return render_template('index.html')
 
-# Handler for the release downloads metadata using the database index of the releases
+# Handler for the release downloads metadata using the database index of the releases. Clients can narrow
+# the metadata down to just what they need by probe, by the OS and architecture BMDA is to run on, to releases
+# from a given version on, and to only the latest few releases - each combination gets its own cache entry
+# The most releases /metadata.json can be asked for the latest of - anything more is the same as asking for all of
+# them, and must not go past what the database can take as a limit
+maxLatestReleases = 2 ** 31 - 1
+
+# Parse how many of the latest releases /metadata.json is being asked for
+def parseLatest(latest: str) -> int:
+	count = int(latest)
+	if count < 1:
+		raise ValueError(f'Invalid number of latest releases {latest}')
+	return min(count, maxLatestReleases)
+
+# The query parameters /metadata.json takes, the arguments of the handler they go to, and how to parse them
+metadataQueryParameters: dict[str, tuple[str, Callable[[str], Any]]] = {
+	'probe': ('probe', Probe.fromString),
+	'os': ('targetOS', TargetOS.fromString),
+	'arch': ('targetArch', TargetArch.fromString),
+	'minVersion': ('minVersion', canonicalVersion),
+	'latest': ('latest', parseLatest),
+}
+
+# Parse the query parameters for /metadata.json into the values they stand for, so all the ways of asking for
+# the same thing (such as `probe=stlinkv2` and `probe=stlink`, or `latest=01` and `latest=1`) share a cache entry
+def metadataQueryArgs(args: MultiDict[str, str]) -> dict[str, Any]:
+	queryArgs = {}
+	try:
+		for parameter, (argument, parse) in metadataQueryParameters.items():
+			if parameter not in args:
+				continue
+			value = parse(args[parameter])
+			if value is None:
+				raise ValueError(f'Invalid architecture name {args[parameter]}')
+			queryArgs[argument] = value
+	except ValueError as error:
+		abort(400, str(error))
+	return queryArgs
+
 @app.route('/metadata.json')
+@cache.json(queryArgs = metadataQueryArgs)
+def metadata(
+	probe: Probe | None = None, targetOS: TargetOS | None = None, targetArch: TargetArch | None = None,
+	minVersion: str | None = None, latest: int | None = None
+):
+	return metadataToJSON(
+		db, probe = probe, targetOS = targetOS, targetArch = targetArch, minVersion = minVersion, latest = latest
+	)
+
+# Handler for the metadata of a specific release
+@app.route('/releases/<version>.json')
+@cache.json
+def release(version: str):
+	result = metadataToJSON(db, version = version)
+	if len(result['releases']) == 0:
+		abort(404)
+	return result
+
+# Handler for the metadata of the newest release, as determined by the semantic ordering of the release versions
+@app.route('/releases/latest.json')
+@cache.json
+def latestRelease():
+	result = metadataToJSON(db, latest = 1)
+	if len(result['releases']) == 0:
+		abort(404)
+	return result
+
+# Handler for the firmware for a probe in the newest release that has any for it
+@app.route('/releases/latest/<probe>')
 @cache.json
-def metadata():
-	# Construct a schema-conforming JSON object from the releases in the database
+def latestProbeRelease(probe: str):
+	try:
+		result = metadataToJSON(db, probe = Probe.fromString(probe), latest = 1)
+	except ValueError:
+		abort(404)
+	if len(result['releases']) == 0:
+		abort(404)
+	return result
+
+# Handler for monitoring how much of our GitHub API budget is left. Only the leader makes API requests, so unless
+# this is the leader, go with what it last noted down in the sync state
+@app.route('/status/rateLimit.json')
+def rateLimitStatus():
+	limit, remaining, resetAt = gitHubAPI.rateLimiter.budget()
+	if limit is None:
+		syncState = db.session.scalar(sql.select(SyncState))
+		if syncState is not None:
+			limit, remaining, resetAt = syncState.rateLimit, syncState.rateLimitRemaining, syncState.rateLimitResetAt
 	return {
-		"$schema": "https://raw.githubusercontent.com/blackmagic-debug/bmputil/refs/heads/main/src/metadata/metadata.schema.json",
-		"version": 1,
-		"releases": releasesToJSON(db)
+		'limit': limit,
+		'remaining': remaining,
+		'resetAt': resetAt,
 	}
 
 @app.post('/releaseUpdate')
@@ -66,7 +210,9 @@ def releaseUpdate():
 			return 'Success', 200
 		# For release requests, dispatch to the release webhook handler
 		case 'release':
-			return gitHubAPI.processReleaseWebhook(db, request, app.config['GITHUB_SECRET'].encode('utf8'), cache)
+			return gitHubAPI.processReleaseWebhook(
+				request, app.config['GITHUB_SECRET'].encode('utf8'), webhookQueue.enqueue
+			)
 		# For everything else, including None, say we're not here
 		case _:
 			return 'Not Found', 404
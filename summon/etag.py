@@ -1,59 +1,517 @@
 # SPDX-License-Identifier: BSD-3-Clause
-from flask import request, make_response, jsonify, Response
+from flask import request, make_response, jsonify, current_app, Response
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
 from typing import Any, TypeAlias
-from collections.abc import Callable
+from collections import Counter, OrderedDict
+from enum import Enum
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from functools import partial
+from inspect import Parameter, signature
 from hashlib import sha256
+from pathlib import Path
+from threading import Lock, Thread, local
+from time import monotonic, sleep, time
+from urllib.parse import urlencode
+import sqlite3
+import json
+import gzip
+import os
+
+# Brotli and Zstandard support are optional, we only precompress with them if they're installed
+try:
+	import brotli
+except ImportError:
+	brotli = None
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
 
 __all__ = (
 	'ETagCache',
+	'SharedETagStore',
 )
 
-JSONHandler: TypeAlias = Callable[[], dict[str, Any] | list[Any]]
+JSONHandler: TypeAlias = Callable[..., dict[str, Any] | list[Any]]
+# Turns the query string of a request into the keyword arguments for a handler
+QueryArgsParser: TypeAlias = Callable[[MultiDict[str, str]], dict[str, Any]]
+
+# Build the table of content encodings responses get precompressed with, in order of preference
+encoders: dict[str, Callable[[bytes], bytes]] = {}
+if brotli is not None:
+	encoders['br'] = lambda data: brotli.compress(data, quality = 11)
+if zstandard is not None:
+	encoders['zstd'] = lambda data: zstandard.ZstdCompressor(level = 19).compress(data)
+# Pin the timestamp in the gzip header so the same content always compresses to the same bytes
+encoders['gzip'] = lambda data: gzip.compress(data, compresslevel = 9, mtime = 0)
+# The list of encodings, including the uncompressed one, that we can offer up for negotiation
+encodings = [*encoders.keys(), 'identity']
+# How long in seconds a worker gets to rebuild an entry before the other workers assume it died and take over
+rebuildLease = 60
+# How long in seconds a request waits on another worker's rebuild of the entry it wants before giving up on
+# them and building the entry itself, so a worker dying mid-rebuild doesn't hold requests up for the whole lease
+maxRebuildWait = 2
+# How long in seconds caches between us and the client may keep serving a response once it's stale while they
+# check with us for a new one
+staleWhileRevalidate = 60
+# How many bytes of responses (counting every encoding) a worker holds at once, and the shared store holds
+maxCachedBytes = 32 * 1024 * 1024
+# How many invalidations of each handler the shared store remembers. Entries built longer ago than that many
+# invalidations are always treated as invalidated, as there's no knowing if any of the missing ones applied
+maxInvalidations = 256
+
+# Defines a store shared between all the worker processes serving summon, which holds a generation number
+# for each cached handler along with the responses built for its entries. Invalidating some or all of a handler's
+# entries bumps its generation and records which entries were invalidated, which every worker can then see with a
+# cheap read and pick up the rebuilt responses from the store rather than each having to rebuild them themselves
+class SharedETagStore:
+	def __init__(self, path: Path) -> None:
+		self.path = path
+		# SQLite connections must not cross threads or forks, so keep one per thread and note which process made it
+		self.connections = local()
+
+	# Get a connection to the store usable from this thread in this process, making one if needed
+	def connection(self) -> sqlite3.Connection:
+		pid = os.getpid()
+		if getattr(self.connections, 'pid', None) != pid:
+			connection = sqlite3.connect(self.path, timeout = 5, isolation_level = None)
+			# Use write-ahead logging so readers checking generations don't get blocked behind an invalidation
+			connection.execute('PRAGMA journal_mode = WAL')
+			connection.execute(
+				'CREATE TABLE IF NOT EXISTS generations (name TEXT PRIMARY KEY, generation INTEGER NOT NULL)'
+			)
+			connection.execute(
+				'CREATE TABLE IF NOT EXISTS invalidations (name TEXT NOT NULL, generation INTEGER NOT NULL, '
+				'prefix TEXT NOT NULL, PRIMARY KEY (name, generation))'
+			)
+			connection.execute(
+				'CREATE TABLE IF NOT EXISTS encodedResponses (name TEXT NOT NULL, generation INTEGER NOT NULL, '
+				'encoding TEXT NOT NULL, headers TEXT NOT NULL, body BLOB NOT NULL, '
+				'PRIMARY KEY (name, generation, encoding))'
+			)
+			connection.execute(
+				'CREATE TABLE IF NOT EXISTS rebuilds (name TEXT PRIMARY KEY, generation INTEGER NOT NULL, '
+				'expires REAL NOT NULL)'
+			)
+			self.connections.connection = connection
+			self.connections.pid = pid
+		return self.connections.connection
+
+	# Look up the current generation of a handler's cache entries
+	def generation(self, name: str) -> int:
+		row = self.connection().execute('SELECT generation FROM generations WHERE name = ?', (name,)).fetchone()
+		if row is None:
+			return 0
+		return row[0]
+
+	# Invalidate a handler's cache entries everywhere by moving them on to the next generation, recording the
+	# prefix the arguments of the entries invalidated start with ('' for all of them)
+	def bump(self, name: str, prefix: str):
+		connection = self.connection()
+		generation, = connection.execute(
+			'INSERT INTO generations (name, generation) VALUES (?, 1) '
+			'ON CONFLICT (name) DO UPDATE SET generation = generation + 1 RETURNING generation',
+			(name,)
+		).fetchone()
+		connection.execute(
+			'INSERT OR REPLACE INTO invalidations (name, generation, prefix) VALUES (?, ?, ?)',
+			(name, generation, prefix)
+		)
+		connection.execute(
+			'DELETE FROM invalidations WHERE name = ? AND generation <= ?', (name, generation - maxInvalidations)
+		)
+
+	# Look up the prefixes of all the invalidations of a handler's entries after one generation up to another,
+	# or None if we no longer know about all of them
+	def invalidations(self, name: str, since: int, until: int) -> list[str] | None:
+		prefixes = [
+			prefix for prefix, in self.connection().execute(
+				'SELECT prefix FROM invalidations WHERE name = ? AND generation > ? AND generation <= ?',
+				(name, since, until)
+			)
+		]
+		if len(prefixes) != until - since:
+			return None
+		return prefixes
+
+	# Try to claim the right to rebuild a cache entry for a given generation, for a number of seconds. This
+	# succeeds if nobody has claimed the rebuild for this generation yet, or if their claim has run out
+	def claim(self, key: str, generation: int, lease: float) -> bool:
+		now = time()
+		cursor = self.connection().execute(
+			'INSERT INTO rebuilds (name, generation, expires) VALUES (?, ?, ?) '
+			'ON CONFLICT (name) DO UPDATE SET generation = excluded.generation, expires = excluded.expires '
+			'WHERE rebuilds.generation < excluded.generation OR rebuilds.expires < ?',
+			(key, generation, now + lease, now)
+		)
+		return cursor.rowcount == 1
+
+	# Give up a claim on rebuilding a cache entry, such as when the rebuild failed, so someone else can try
+	def release(self, key: str):
+		self.connection().execute('DELETE FROM rebuilds WHERE name = ?', (key,))
+
+	# Look up the responses (one per content encoding) most recently stored for a cache entry, along with the
+	# generation they were built for
+	def load(self, key: str) -> tuple[int, dict[str, Response]] | None:
+		connection = self.connection()
+		row = connection.execute('SELECT MAX(generation) FROM encodedResponses WHERE name = ?', (key,)).fetchone()
+		if row[0] is None:
+			return None
+		generation = row[0]
+		rows = connection.execute(
+			'SELECT encoding, headers, body FROM encodedResponses WHERE name = ? AND generation = ?',
+			(key, generation)
+		)
+		return generation, {
+			encoding: Response(body, headers = json.loads(headers)) for encoding, headers, body in rows
+		}
 
-# Defines a cache which uses ETags of the content to determine whether to spend bandwidth or not
+	# Store the responses built for a cache entry at a given generation, replacing any older ones for the entry,
+	# then drop the least recently stored entries until the store is back within its byte budget
+	def store(self, key: str, generation: int, responses: dict[str, Response]):
+		connection = self.connection()
+		connection.execute('DELETE FROM encodedResponses WHERE name = ? AND generation < ?', (key, generation))
+		connection.executemany(
+			'INSERT OR REPLACE INTO encodedResponses (name, generation, encoding, headers, body) '
+			'VALUES (?, ?, ?, ?, ?)',
+			(
+				(key, generation, encoding, json.dumps(list(response.headers.items())), response.data)
+				for encoding, response in responses.items()
+			)
+		)
+		# Replacing an entry gives it new rowids, so the entries with the lowest are those stored longest ago.
+		# Add up the sizes of the entries from the most recently stored back, and drop those that go over budget
+		connection.execute(
+			'DELETE FROM encodedResponses WHERE name IN (SELECT name FROM (SELECT name, '
+			'SUM(SUM(LENGTH(body))) OVER (ORDER BY MAX(rowid) DESC) AS total FROM encodedResponses GROUP BY name) '
+			'WHERE total > ? AND name != ?)',
+			(maxCachedBytes, key)
+		)
+		# Also clear out any claims on rebuilds which have long since run out
+		connection.execute('DELETE FROM rebuilds WHERE expires < ?', (time(),))
+
+# Defines an entry in the cache: the responses built for a handler from one set of arguments (one response per
+# content encoding), along with the generation they are current for and how to build them again
+class CacheEntry:
+	def __init__(self, responses: dict[str, Response], generation: int, build: Callable[[], Response]) -> None:
+		self.responses = responses
+		self.etags = {encoding: response.headers['ETag'] for encoding, response in responses.items()}
+		self.generation = generation
+		self.build = build
+		self.size = sum(len(response.data) for response in responses.values())
+
+# Defines a cache which uses ETags of the content to determine whether to spend bandwidth or not. Each handler
+# can have many entries in the cache, one for each set of arguments (from the route and query string) it gets
+# called with, keyed by the handler's name and those arguments. Only so many bytes of entries are held, with the
+# least recently used thrown away to make room
 class ETagCache:
-	def __init__(self) -> None:
-		self.etagCache: dict[Callable, str] = {}
-		self.responseCache: dict[Callable, Response] = {}
-
-	# Decorates an endpoint that returns JSON for being ETag cached
-	def json(self, handler: JSONHandler):
-		return ETagJSONHandler(self, handler)
-
-	# Look up a handler to see if there's an etag in cache for it
-	def lookupETag(self, handler) -> str | None:
-		return self.etagCache.get(handler)
-
-	# Look up a handler to see if there's a response in cache for it
-	def lookupResponse(self, handler) -> Response | None:
-		return self.responseCache.get(handler)
-
-	# Cache a response, computing its etag
-	def etag(self, handler, response: Response):
-		etag = f'"{sha256(response.data).hexdigest()}"'
-		response.headers["ETag"] = etag
-
-		# Enter the new ETag and response into the cache
-		self.etagCache[handler] = etag
-		self.responseCache[handler] = response
-
-	# Invalidate a cache entry by handler name
-	def invalidate(self, *, handlerName: str):
-		# Scrub through the cache looking for a handler with a matching name in the cache
-		for key in self.etagCache.keys():
-			# If we've found one, then drop its entries to force a re-cache
-			if key.__name__ == handlerName:
-				del self.etagCache[key]
-				del self.responseCache[key]
-				# And stop so the iteration doesn't get grumpy at us
-				break
+	def __init__(self, storePath: Path | None = None) -> None:
+		# Hold the entries in least to most recently used order so we know what to drop when over budget
+		self.entries: OrderedDict[str, CacheEntry] = OrderedDict()
+		self.cachedBytes = 0
+		self.entriesLock = Lock()
+		# If we've been given somewhere to share the cache with other workers, set that up, otherwise
+		# keep track of the current generation of each handler's entries and their invalidations locally
+		self.store = SharedETagStore(storePath) if storePath is not None else None
+		self.generations: dict[str, int] = {}
+		self.invalidationPrefixes: dict[str, dict[int, str]] = {}
+
+		# Keep track of the handlers we've been asked to cache by name so they can be warmed, and of
+		# which entries are being rebuilt so concurrent requests for an entry coalesce onto a single rebuild of
+		# it. Each entry being rebuilt gets a lock, along with how many are using it, which goes away once unused
+		self.handlers: dict[str, ETagJSONHandler] = {}
+		self.rebuildLocks: dict[str, tuple[Lock, int]] = {}
+		self.rebuildLocksLock = Lock()
+		self.pendingLock = Lock()
+		self.pendingRebuilds: set[str] = set()
+
+		# Count how requests for each handler got served - from a current entry (a hit), from an entry while it's
+		# rebuilt in the background (a stale hit), or by having to wait on the entry being built (a miss)
+		self.hits: Counter[str] = Counter()
+		self.staleHits: Counter[str] = Counter()
+		self.misses: Counter[str] = Counter()
+
+	# Decorates an endpoint that returns JSON for being ETag cached. By default the handler gets the query parameters
+	# named the same as its arguments, but a handler can instead be given a function that picks out its arguments
+	# from the query string, as `@cache.json(queryArgs = parser)`
+	def json(self, handler: JSONHandler | None = None, *, queryArgs: QueryArgsParser | None = None):
+		if handler is None:
+			return partial(self.json, queryArgs = queryArgs)
+		jsonHandler = ETagJSONHandler(self, handler, queryArgs)
+		self.handlers[handler.__name__] = jsonHandler
+		return jsonHandler
+
+	# Work out the key for a handler's entry for a given set of arguments from the route and query string. The
+	# arguments are normalised so the order they were given in doesn't matter, with those from the route first
+	# so that invalidating by prefix can pick out all the entries for, say, a particular release version.
+	# Enumerated arguments are keyed by name so the key reads the same whatever the enum's values are
+	@staticmethod
+	def entryKey(handlerName: str, viewArgs: dict[str, Any], queryArgs: dict[str, Any]) -> str:
+		if len(viewArgs) == 0 and len(queryArgs) == 0:
+			return handlerName
+		args = [
+			(name, value.name if isinstance(value, Enum) else value)
+			for name, value in sorted(viewArgs.items()) + sorted(queryArgs.items())
+		]
+		return f'{handlerName}?{urlencode(args)}'
+
+	# Look up what the current generation of a handler's entries is
+	def currentGeneration(self, handlerName: str) -> int:
+		if self.store is not None:
+			return self.store.generation(handlerName)
+		return self.generations.get(handlerName, 0)
+
+	# Determine if an entry built for one generation of a handler's entries got invalidated by the time of another
+	def invalidatedSince(self, key: str, since: int, until: int) -> bool:
+		handlerName, _, args = key.partition('?')
+		if self.store is not None:
+			prefixes = self.store.invalidations(handlerName, since, until)
+		else:
+			handlerPrefixes = self.invalidationPrefixes.get(handlerName, {})
+			prefixes = [handlerPrefixes[generation] for generation in range(since + 1, until + 1)]
+		# If we don't know what got invalidated in that time, we have to assume it was this entry
+		if prefixes is None:
+			return True
+		return any(args.startswith(prefix) for prefix in prefixes)
+
+	# Bring this worker's entry for a handler up to date with the shared store if there is one, returning
+	# the entry if it is now fresh (and marking it used). If it is not, any entry held is left in place to be
+	# served stale
+	def refresh(self, handler, key: str, build: Callable[[], Response]) -> CacheEntry | None:
+		# Check what generation the handler's entries are on - if it matches what we have, we're done
+		generation = self.currentGeneration(handler.__name__)
+		entry = self.lookupEntry(key)
+		if entry is not None:
+			if entry.generation == generation:
+				return entry
+			# If the invalidations since our entry was built were all for other entries, it's still current
+			if not self.invalidatedSince(key, entry.generation, generation):
+				entry.generation = generation
+				return entry
+
+		# Otherwise our entry is stale, so see if another worker already built the new one
+		if self.store is None:
+			return None
+		stored = self.store.load(key)
+		if stored is None:
+			return None
+		storedGeneration, responses = stored
+		if storedGeneration != generation and self.invalidatedSince(key, storedGeneration, generation):
+			return None
+		entry = CacheEntry(responses, generation, build)
+		self.enter(key, entry)
+		return entry
+
+	# Rebuild a handler's entry, making sure only one rebuild happens at a time in this process and, via
+	# a lease on the shared store, across all the workers. Anyone else that gets here in the mean time waits
+	# on that rebuild and picks up its result rather than doing the work again. The up to date entry is handed
+	# back, so callers can serve it even if it gets dropped from the cache to make room for another straight away
+	def rebuild(self, handler, key: str, build: Callable[[], Response]) -> CacheEntry:
+		with self.rebuildLock(key):
+			giveUpAt = monotonic() + maxRebuildWait
+			while True:
+				# If the entry got brought up to date while we were waiting, we're done
+				entry = self.refresh(handler, key, build)
+				if entry is not None:
+					return entry
+				# Otherwise try to claim the rebuild for the current generation, and if another worker has it,
+				# wait a moment for them to finish before checking again
+				generation = self.currentGeneration(handler.__name__)
+				claimed = self.store is None or self.store.claim(key, generation, rebuildLease)
+				if claimed:
+					break
+				# If they're taking too long about it (they may well have died), build it ourselves instead
+				if monotonic() >= giveUpAt:
+					break
+				sleep(0.05)
+
+			# Build the new response and enter it into the cache via computing its ETag. If that fails, let go
+			# of our claim on the rebuild so the next request for the entry doesn't have to wait out the lease
+			try:
+				response = build()
+			except BaseException as error:
+				if self.store is not None and claimed:
+					self.store.release(key)
+				# If the handler decided there's no longer anything to serve for the entry (such as for a release
+				# that's since been deleted), drop what we have rather than keep serving it stale
+				if isinstance(error, HTTPException):
+					self.discard(key)
+				raise
+			return self.etag(key, response, generation, build)
+
+	# Hold the lock on rebuilding an entry, so rebuilds of the same entry queue up behind each other while those
+	# of different entries (such as for different filters on the same handler) go ahead at the same time
+	@contextmanager
+	def rebuildLock(self, key: str) -> Iterator[None]:
+		with self.rebuildLocksLock:
+			lock, users = self.rebuildLocks.get(key, (None, 0))
+			if lock is None:
+				lock = Lock()
+			self.rebuildLocks[key] = (lock, users + 1)
+		try:
+			with lock:
+				yield
+		finally:
+			with self.rebuildLocksLock:
+				lock, users = self.rebuildLocks[key]
+				if users == 1:
+					del self.rebuildLocks[key]
+				else:
+					self.rebuildLocks[key] = (lock, users - 1)
+
+	# Kick off a rebuild of a handler's entry in the background, unless one is already underway
+	def revalidate(self, handler, key: str, build: Callable[[], Response]):
+		with self.pendingLock:
+			if key in self.pendingRebuilds:
+				return
+			self.pendingRebuilds.add(key)
+
+		# The rebuild needs an app context to talk to the database in, so grab the app to make one from
+		app = current_app._get_current_object()
+		def backgroundRebuild():
+			try:
+				with app.app_context():
+					self.rebuild(handler, key, build)
+			# The handler turning the request down is not a failure, the next request will get the same answer
+			except HTTPException:
+				pass
+			except Exception:
+				app.logger.exception(f'Failed to rebuild cache entry {key}')
+			finally:
+				with self.pendingLock:
+					self.pendingRebuilds.discard(key)
+		Thread(target = backgroundRebuild, name = f'rebuild-{key}', daemon = True).start()
+
+	# Warm the cache entries for a handler by name, rebuilding the ones this worker holds in the background
+	# rather than on the next request for each of them
+	def warm(self, *, handlerName: str):
+		jsonHandler = self.handlers.get(handlerName)
+		if jsonHandler is None:
+			return
+		with self.entriesLock:
+			entries = {
+				key: entry.build for key, entry in self.entries.items()
+				if key == handlerName or key.startswith(f'{handlerName}?')
+			}
+		# If the handler can be called without any arguments, always warm the entry for that too
+		if handlerName not in entries and not jsonHandler.requiresArgs:
+			entries[handlerName] = partial(jsonHandler.build, {}, {})
+		for key, build in entries.items():
+			self.revalidate(jsonHandler.handler, key, build)
+
+	# Look up an entry in the cache, marking it used
+	def lookupEntry(self, key: str) -> CacheEntry | None:
+		with self.entriesLock:
+			entry = self.entries.get(key)
+			if entry is not None:
+				self.entries.move_to_end(key)
+		return entry
+
+	# Look up an entry to see if there's an etag in cache for it in the given encoding
+	def lookupETag(self, key: str, encoding: str = 'identity') -> str | None:
+		with self.entriesLock:
+			entry = self.entries.get(key)
+		if entry is None:
+			return None
+		return entry.etags.get(encoding)
+
+	# Look up an entry to see if there's a response in cache for it in the given encoding, marking it used
+	def lookupResponse(self, key: str, encoding: str = 'identity') -> Response | None:
+		entry = self.lookupEntry(key)
+		if entry is None:
+			return None
+		return entry.responses.get(encoding)
+
+	# Cache a response built for a given generation, computing its etag and building all the
+	# precompressed encodings of it, and hand back the new entry
+	def etag(self, key: str, response: Response, generation: int, build: Callable[[], Response]) -> CacheEntry:
+		digest = sha256(response.data).hexdigest()
+		# All the encodings vary on what the client accepts, so make sure caches between us and them know that
+		response.headers['Vary'] = 'Accept-Encoding'
+		response.headers['ETag'] = f'"{digest}"'
+		responses = {'identity': response}
+
+		# Compress the response in each of the encodings we support. Each encoding is a different representation
+		# of the content as far as HTTP is concerned, so gets its own strong ETag derived from the uncompressed one
+		for encoding, encoder in encoders.items():
+			encodedResponse = Response(encoder(response.data), headers = response.headers.copy())
+			encodedResponse.headers['Content-Encoding'] = encoding
+			encodedResponse.headers['ETag'] = f'"{digest}-{encoding}"'
+			responses[encoding] = encodedResponse
+
+		# Enter the new ETags and responses into the cache
+		entry = CacheEntry(responses, generation, build)
+		self.enter(key, entry)
+		# And share them with the other workers against the generation they were built for
+		if self.store is not None:
+			self.store.store(key, generation, responses)
+		return entry
+
+	# Enter an entry into the cache as the most recently used, and if that takes us over budget,
+	# drop the least recently used entries (though never the one just entered)
+	def enter(self, key: str, entry: CacheEntry):
+		with self.entriesLock:
+			oldEntry = self.entries.pop(key, None)
+			if oldEntry is not None:
+				self.cachedBytes -= oldEntry.size
+			self.entries[key] = entry
+			self.cachedBytes += entry.size
+			while self.cachedBytes > maxCachedBytes and len(self.entries) > 1:
+				_, evictedEntry = self.entries.popitem(last = False)
+				self.cachedBytes -= evictedEntry.size
+
+	# Drop an entry from the cache
+	def discard(self, key: str):
+		with self.entriesLock:
+			entry = self.entries.pop(key, None)
+			if entry is not None:
+				self.cachedBytes -= entry.size
+
+	# Invalidate the cache entries for a handler by name, either all of them or only those whose (normalised)
+	# arguments start with a given prefix - for example, `version=v1.0.0` for the entries of a route taking the
+	# version as an argument, whatever query parameters they had. The entries are kept around to be served stale
+	# until they are rebuilt
+	def invalidate(self, *, handlerName: str, prefix: str = ''):
+		# Move the entries on a generation - if they're shared, this makes all the other workers see that too
+		if self.store is not None:
+			self.store.bump(handlerName, prefix)
+		else:
+			generation = self.generations.get(handlerName, 0) + 1
+			self.generations[handlerName] = generation
+			self.invalidationPrefixes.setdefault(handlerName, {})[generation] = prefix
+
+	# Get a snapshot of how well the cache is doing for each handler, and how much it is holding
+	def stats(self) -> dict[str, Any]:
+		with self.entriesLock:
+			entries = len(self.entries)
+			cachedBytes = self.cachedBytes
+		return {
+			'entries': entries,
+			'bytes': cachedBytes,
+			'handlers': {
+				name: {
+					'hits': self.hits[name],
+					'staleHits': self.staleHits[name],
+					'misses': self.misses[name],
+				}
+				for name in self.handlers
+			},
+		}
 
 # Defines the handling for an ETag cached request for JSON
 class ETagJSONHandler:
-	def __init__(self, cache: ETagCache, handler: JSONHandler):
-		# Store the cache instance and handler we're wrapping
+	def __init__(self, cache: ETagCache, handler: JSONHandler, queryArgs: QueryArgsParser | None = None):
+		# Store the cache instance and handler we're wrapping, and how to get its arguments from the query string
 		self.cache = cache
 		self.handler = handler
+		self.queryArgs = queryArgs
+		# The arguments the handler takes are whichever (keyword) arguments it has, and we'll need to
+		# know if it can be called with none at all
+		parameters = signature(handler).parameters
+		self.parameters = tuple(parameters)
+		self.requiresArgs = any(parameter.default is Parameter.empty for parameter in parameters.values())
 
 		# Copy a few properties from the handler function so Flask.route() works right
 		self.__module__ = handler.__module__
@@ -62,31 +520,60 @@ class ETagJSONHandler:
 		self.__doc__ = handler.__doc__
 		self.__annotations__ = handler.__annotations__
 
-	# Invoked when this handler is called on for a request
-	def __call__(self):
+	# Invoked when this handler is called on for a request, with any arguments from the route
+	def __call__(self, **viewArgs):
+		# Pick out the query parameters the handler takes (ignoring any others, so they don't make for needless
+		# extra cache entries, and any the route already provides), and work out which cache entry that makes this
+		if self.queryArgs is not None:
+			queryArgs = self.queryArgs(request.args)
+		else:
+			queryArgs = {
+				name: request.args[name] for name in self.parameters if name in request.args and name not in viewArgs
+			}
+		key = self.cache.entryKey(self.__name__, viewArgs, queryArgs)
+		build = partial(self.build, viewArgs, queryArgs)
+
+		# Make sure what we have cached is still current with respect to any invalidations. Hold on to the entry
+		# we end up with, so it can still be served if it gets dropped to make room for another in the mean time
+		entry = self.cache.refresh(self.handler, key, build)
+		if entry is not None:
+			self.cache.hits[self.__name__] += 1
+		else:
+			entry = self.cache.lookupEntry(key)
+			# If it is not, and we have nothing at all to serve, we have to wait on a new response being built
+			if entry is None:
+				self.cache.misses[self.__name__] += 1
+				entry = self.cache.rebuild(self.handler, key, build)
+			# Otherwise keep serving what we have while a new one is built in the background
+			else:
+				self.cache.staleHits[self.__name__] += 1
+				self.cache.revalidate(self.handler, key, build)
+
+		# Figure out which of the encodings we have on offer the client would most like to get
+		encoding = request.accept_encodings.best_match(encodings, default = 'identity')
+
 		# Check to see if the request has an If-None-Match ETag header
 		etag = request.headers.get('If-None-Match')
-		# If the request does, look the handler up in the ETag cache and check if they match
+		# If the request does, look the entry up in the ETag cache and check if they match
 		if etag is not None:
-			# If the etag has been weakened (eg, because nginx did gzip compression), strip the weakening
+			# If the etag has been weakened (eg, because a proxy did its own compression), strip the weakening
 			if etag.startswith('W/'):
 				etag = etag[2:]
-			cachedETag = self.cache.lookupETag(self.handler)
+			cachedETag = entry.etags.get(encoding)
 			# If the tags match, tell the client nothing changed
 			if cachedETag == etag:
 				response = make_response('Not Modified', 304)
 				response.headers['ETag'] = etag
+				response.headers['Vary'] = 'Accept-Encoding'
 				return response
 
-		# If we didn't get a matching ETag from the client, see if there's a cached response
-		response = self.cache.lookupResponse(self.handler)
-		# If there is, then we're done - just return it.
-		if response is not None:
-			return response
-
-		# Otherwise, we have to build a new one
-		response = jsonify(self.handler())
-		# Mark it cached and enter it into the cache via computing its ETag
-		response.headers['Cache-Control'] = 'max-age=604800, no-cache, public'
-		self.cache.etag(self.handler, response)
+		# Otherwise hand back the cached response
+		return entry.responses[encoding]
+
+	# Build a new response from the handler for a set of arguments, ready to be entered into the cache
+	def build(self, viewArgs: dict[str, Any], queryArgs: dict[str, Any]) -> Response:
+		response = jsonify(self.handler(**viewArgs, **queryArgs))
+		# Mark it cached, letting caches between us and the client keep serving it for a little while after it goes
+		# stale so long as they check with us for a new one in the background
+		response.headers['Cache-Control'] = f'public, max-age=0, stale-while-revalidate={staleWhileRevalidate}'
 		return response
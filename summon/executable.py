@@ -0,0 +1,102 @@
+# SPDX-License-Identifier: BSD-3-Clause
+from struct import unpack_from, error as StructError
+
+from .types import TargetArch
+
+__all__ = (
+	'headerSize',
+	'executableArch',
+)
+
+# How much of the start of an executable we need to be able to determine its architecture. The only header
+# not right at the start is the PE one, which the DOS stub points to and is nearly always in the first few hundred bytes
+headerSize = 4096
+
+# Map of ELF e_machine values to the architectures they represent
+elfMachines = {
+	3: TargetArch.i386, # EM_386
+	40: TargetArch.aarch32, # EM_ARM
+	62: TargetArch.amd64, # EM_X86_64
+	183: TargetArch.aarch64, # EM_AARCH64
+}
+
+# Map of PE/COFF Machine values to the architectures they represent
+peMachines = {
+	0x014c: TargetArch.i386, # IMAGE_FILE_MACHINE_I386
+	0x01c0: TargetArch.aarch32, # IMAGE_FILE_MACHINE_ARM
+	0x01c2: TargetArch.aarch32, # IMAGE_FILE_MACHINE_THUMB
+	0x01c4: TargetArch.aarch32, # IMAGE_FILE_MACHINE_ARMNT
+	0x8664: TargetArch.amd64, # IMAGE_FILE_MACHINE_AMD64
+	0xaa64: TargetArch.aarch64, # IMAGE_FILE_MACHINE_ARM64
+}
+
+# Map of Mach-O cputype values to the architectures they represent
+machOCPUTypes = {
+	7: TargetArch.i386, # CPU_TYPE_X86
+	12: TargetArch.aarch32, # CPU_TYPE_ARM
+	0x01000007: TargetArch.amd64, # CPU_TYPE_X86_64
+	0x0100000c: TargetArch.aarch64, # CPU_TYPE_ARM64
+}
+
+# When a Mach-O fat (universal) binary contains several architectures, this is the order of preference
+# for which one it gets listed as
+fatArchPreference = (TargetArch.amd64, TargetArch.i386, TargetArch.aarch64, TargetArch.aarch32)
+
+# Determine the architecture of an executable (ELF, PE or Mach-O) from the first few bytes of it
+def executableArch(header: bytes) -> TargetArch | None:
+	try:
+		if header.startswith(b'\x7fELF'):
+			return elfArch(header)
+		if header.startswith(b'MZ'):
+			return peArch(header)
+		magic = header[0:4]
+		if magic in (b'\xfe\xed\xfa\xce', b'\xfe\xed\xfa\xcf', b'\xce\xfa\xed\xfe', b'\xcf\xfa\xed\xfe'):
+			return machOArch(header)
+		if magic in (b'\xca\xfe\xba\xbe', b'\xca\xfe\xba\xbf'):
+			return fatMachOArch(header)
+	# If the header turned out to be truncated, we can't tell what it is
+	except (StructError, IndexError):
+		pass
+	return None
+
+def elfArch(header: bytes) -> TargetArch | None:
+	# EI_DATA tells us the byte order of the rest of the header, then e_machine lives at the same place for
+	# both 32- and 64-bit ELF files
+	byteOrder = '<' if header[5] == 1 else '>'
+	machine, = unpack_from(f'{byteOrder}H', header, 18)
+	return elfMachines.get(machine)
+
+def peArch(header: bytes) -> TargetArch | None:
+	# The DOS header's e_lfanew tells us where the PE signature is, which is followed by the COFF header
+	peOffset, = unpack_from('<I', header, 0x3c)
+	if header[peOffset:peOffset + 4] != b'PE\0\0':
+		return None
+	machine, = unpack_from('<H', header, peOffset + 4)
+	return peMachines.get(machine)
+
+def machOArch(header: bytes) -> TargetArch | None:
+	# The magic is always written in the byte order of the rest of the header, and cputype follows it
+	byteOrder = '>' if header[0] == 0xfe else '<'
+	cpuType, = unpack_from(f'{byteOrder}i', header, 4)
+	return machOCPUTypes.get(cpuType)
+
+def fatMachOArch(header: bytes) -> TargetArch | None:
+	# Fat headers are always big endian, and the magic tells us if the entries have 32- or 64-bit offsets
+	entrySize = 32 if header[3] == 0xbf else 20
+	archCount, = unpack_from('>I', header, 4)
+	# Java class files share the fat binary magic, but have a version number here far bigger than the
+	# number of architectures any real fat binary contains
+	if archCount == 0 or archCount > 16:
+		return None
+
+	# Collect up all the architectures in the binary and pick the one we'd most like to list it as
+	arches = set()
+	for index in range(archCount):
+		cpuType, = unpack_from('>i', header, 8 + index * entrySize)
+		arch = machOCPUTypes.get(cpuType)
+		if arch is not None:
+			arches.add(arch)
+	for arch in fatArchPreference:
+		if arch in arches:
+			return arch
+	return None
@@ -6,79 +6,345 @@ from pathlib import Path
 from zipfile import ZipFile, ZipInfo
 from hashlib import sha256
 from hmac import HMAC, compare_digest
+from urllib.parse import parse_qs, urlparse
+from collections import deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from threading import Lock
+from typing import BinaryIO, cast
 import requests
-import magic
 
-from .models import Release, ReleaseProbe, FirmwareDownload, BMDABinary
+from .models import Release, ReleaseProbe, FirmwareDownload, BMDABinary, APIValidator, AssetInspection, SyncState
 from .githubTypes import GitHubRelease, GitHubAsset, GitHubReleaseWebhook, GitHubReleaseChanges
 from .types import Probe, variantFriendlyName, TargetOS, TargetArch
-from .etag import ETagCache
+from .executable import executableArch, headerSize as executableHeaderSize
+from .remoteFile import RemoteFile, tailSize as remoteFileTailSize
+from .httpSession import HTTPSession
+from .rateLimit import RateLimiter, withRequestPriority
+from .jsonStream import iterJSONArray
 
 # All valid release files start with this prefix
 fileNamePrefix = 'blackmagic-'
+# Where the list of releases for the BMD repo lives, and how many releases to ask for per page of it (the API maximum)
+releasesURI = 'https://api.github.com/repos/blackmagic-debug/blackmagic/releases'
+releasesPerPage = 100
+
+# The only parts of the releases and their assets in the releases list that we make any use of
+releaseFields = ('id', 'tag_name', 'draft', 'published_at')
+assetFields = ('id', 'name', 'size', 'updated_at', 'browser_download_url')
+
+# Build the URI for a specific page of the releases list
+def releasesPageURI(page: int) -> str:
+	return f'{releasesURI}?per_page={releasesPerPage}&page={page}'
 
 # Represents our bindings to the GitHub API as much as we care to have
 class GitHubAPI:
 	# Initialise a connection to the API using the API token from the config
-	def __init__(self, token: str | None) -> None:
+	def __init__(
+		self, token: str | None, *, connectTimeout: float = 10, readTimeout: float = 60, maxRetries: int = 5,
+		downloadChunkSize: int = 64 * 1024, rateLimitReserve: int = 50, maxRateLimitWait: float = 60
+	) -> None:
 		self.apiToken = token
 		# For now, we conform to the API version from 2022-11-28
 		self.apiVersion = '2022-11-28'
-
-	# Extract a list of current releases off the BMD repo, and update the DB with it
-	def updateReleases(self, db: SQLAlchemy):
+		# Limit how many requests we make of the API at once
+		self.maxConcurrentRequests = 4
+		# And how many BMDA archives we download and inspect at once
+		self.maxConcurrentDownloads = 8
+		# And how big a BMDA archive we're willing to hold in memory while inspecting it
+		self.maxArchiveMemory = 16 * 1024 * 1024
+		# And how much of a BMDA archive to pull down at a time when downloading all of it
+		self.downloadChunkSize = downloadChunkSize
+		# Make all our requests through one session so connections to GitHub get reused rather than each
+		# request doing its own TLS handshake, keeping enough of them for all our requests and downloads at once
+		self.session = HTTPSession(
+			max(self.maxConcurrentRequests, self.maxConcurrentDownloads), (connectTimeout, readTimeout), maxRetries
+		)
+		# Requests to the API itself (but not downloads of release assets, which don't count against
+		# the API rate limit) go through a scheduler that keeps us within our API budget
+		self.rateLimiter = RateLimiter(rateLimitReserve, maxRateLimitWait)
+		# The release sync and the processing of webhook notifications run on different threads, and can both
+		# go to index the same new release. Writes to the index from either get made while holding this, so
+		# they can't trip over each other
+		self.indexLock = Lock()
+
+	# Build the set of headers needed for a request to the API
+	def requestHeaders(self) -> dict[str, str]:
 		# If there is an API token to use, make use of it
 		if self.apiToken is not None:
 			headers = {'Authorization': f'Bearer {self.apiToken}'}
 		else:
 			headers = {}
 		headers['X-GitHub-Api-Version'] = self.apiVersion
+		return headers
+
+	# Extract a list of current releases off the BMD repo, and update the DB with it, returning whether any
+	# new releases got indexed. Normally this only looks at releases published since the newest one we've seen,
+	# but a full reconciliation with the complete list of releases can be asked for instead
+	def updateReleases(self, db: SQLAlchemy, full: bool = False) -> bool:
+		# Find out where we got to the last time we synced, making a fresh sync state if this is the first time
+		syncState = db.session.scalar(sql.select(SyncState))
+		if syncState is None:
+			syncState = SyncState()
+			db.session.add(syncState)
+
+		# If we have not synced before, there's nothing to be incremental from, so do a full sync. A full
+		# reconciliation that was asked for has to look at every page, whether or not GitHub says it has changed,
+		# as it's there to pick up what we're missing from pages we've already seen
+		if full or syncState.newestPublishedAt is None:
+			releaseFragments = self.fetchReleases(db, syncState, conditional = not full)
+		else:
+			releaseFragments = self.fetchNewReleases(syncState)
+
+		# Which releases we already have indexed, found out in one go rather than asking about each release in turn.
+		# This is only looked up once there turn out to be releases to check, so a sync that GitHub tells us has
+		# nothing new doesn't have to go through the whole index
+		indexedVersions: set[str] | None = None
+		changed = False
+		# Build up all the new rows in memory without flushing any of them out, so they all go to the
+		# database together as bulk inserts when committed
+		with db.session.no_autoflush:
+			# Iterate through all the release descriptors that GitHub has for the repo which might have changed,
+			# which get parsed out of the releases list as it arrives and trimmed down to what we use, with only
+			# a few pages of the list fetched ahead of the release being indexed. The rows for newly indexed
+			# releases do build up until the commit below, but releases already indexed add nothing
+			for releaseFragment in releaseFragments:
+				if indexedVersions is None:
+					indexedVersions = set(db.session.scalars(sql.select(Release.version)))
+				# Try to index each one, keeping track of if any were new
+				if self.indexRelease(db, releaseFragment, indexedVersions):
+					changed = True
+				# Move the sync cursor on to the newest release we've now seen
+				self.advanceSyncState(syncState, releaseFragment)
+		self.recordRateLimit(syncState)
+
+		# Make sure any additions made by this function to the databse stick, along with the sync state
+		# and validators for the pages of the releases list that made them. If webhook notifications got any of
+		# the same releases indexed while we were working, theirs stand and ours get dropped
+		with self.indexLock:
+			self.dropIndexedElsewhere(db)
+			db.session.commit()
+		return changed
+
+	# Drop any releases and asset inspections waiting to be added to the database which, since we decided to add
+	# them, something else has already added
+	def dropIndexedElsewhere(self, db: SQLAlchemy):
+		with db.session.no_autoflush:
+			newReleases = {item.version: item for item in db.session.new if isinstance(item, Release)}
+			if len(newReleases) != 0:
+				for version in db.session.scalars(
+					sql.select(Release.version).where(Release.version.in_(newReleases.keys()))
+				):
+					db.session.expunge(newReleases[version])
+			newInspections = {item.assetID: item for item in db.session.new if isinstance(item, AssetInspection)}
+			if len(newInspections) != 0:
+				for assetID in db.session.scalars(
+					sql.select(AssetInspection.assetID).where(AssetInspection.assetID.in_(newInspections.keys()))
+				):
+					db.session.expunge(newInspections[assetID])
+
+	# Fetch only the releases published since the newest one we've seen off the BMD repo. The list is newest first
+	# by when the releases were created, so this walks the pages of it in order until reaching a page with a
+	# release published before that. This goes by when releases were published rather than their IDs as a release
+	# gets its ID when it is created as a draft - so one drafted before, but published after, the newest release
+	# we've seen has an older ID, and is further down the list, than that release
+	def fetchNewReleases(self, syncState: SyncState) -> Iterator[GitHubRelease]:
+		# Fire off the request for the first page, conditional on the list having changed since we last looked
+		response, releases = self.fetchReleasesListPage(releasesPageURI(1), syncState.listingETag)
+		# If it has not, no releases have been made and we have nothing to do
+		if releases is None:
+			return
+		syncState.listingETag = response.headers.get('ETag')
+		# Grab when the newest release we've seen was published now, as the cursor gets moved on as the new
+		# releases get indexed
+		newestPublishedAt = syncState.newestPublishedAt
+
+		while True:
+			seenOld = False
+			# Pass on the releases on this page published since the newest we've seen (which includes that
+			# release itself, but that's already indexed so gets skipped), skipping over any drafts
+			for release in releases:
+				publishedAt = release['published_at']
+				if release['draft'] or publishedAt is None:
+					continue
+				if publishedAt >= newestPublishedAt:
+					yield release
+				else:
+					seenOld = True
+			# If we hit one published before the newest we've seen, or this was the last page, we're done
+			nextPage = response.links.get('next')
+			if seenOld or nextPage is None:
+				return
+			response, releases = self.fetchReleasesListPage(nextPage['url'])
+			if releases is None:
+				return
 
-		# Fire off the request with the API token and version specified
-		response = requests.get(
-			'https://api.github.com/repos/blackmagic-debug/blackmagic/releases',
-			headers = headers
-		)
-		# We expect the response to be encoded as JSON
-		# XXX: Need to deal with the fact this response is pagenated to 30 results per request
-		releaseFragments: list[GitHubRelease] = response.json()
-
-		# Iterate through all the release descriptors that GitHub has returned
-		for releaseFragment in releaseFragments:
-			# Try to index each one
-			self.indexRelease(db, releaseFragment)
-
-		# Make sure any additions made by this function to the databse stick
+	# Parse the releases out of a page of the releases list as it arrives, keeping only the parts we use of each
+	def releasesInPage(self, response: requests.Response) -> Iterator[GitHubRelease]:
+		for release in iterJSONArray(response.iter_content(chunk_size = self.downloadChunkSize)):
+			fragment = {field: release[field] for field in releaseFields}
+			fragment['assets'] = [{field: asset[field] for field in assetFields} for asset in release['assets']]
+			yield cast(GitHubRelease, fragment)
+
+	# Move the sync cursor on to a release, if it was published after the one the cursor is at. Drafts have no
+	# publication time so never move the cursor, and as it goes by when releases were published rather than their
+	# IDs, they still get picked up by the next incremental sync after they are published
+	def advanceSyncState(self, syncState: SyncState, releaseFragment: GitHubRelease):
+		publishedAt = releaseFragment['published_at']
+		if releaseFragment['draft'] or publishedAt is None:
+			return
+		if syncState.newestPublishedAt is None or publishedAt > syncState.newestPublishedAt:
+			syncState.newestReleaseID = releaseFragment['id']
+			syncState.newestPublishedAt = releaseFragment['published_at']
+
+	# Note down how much of our API budget is left in the sync state so it can be monitored from any worker
+	def recordRateLimit(self, syncState: SyncState):
+		syncState.rateLimit, syncState.rateLimitRemaining, syncState.rateLimitResetAt = self.rateLimiter.budget()
+
+	# Note down how much of our API budget is left outside of a sync, such as when a sync ran out of it
+	def saveRateLimit(self, db: SQLAlchemy):
+		syncState = db.session.scalar(sql.select(SyncState))
+		if syncState is None:
+			syncState = SyncState()
+			db.session.add(syncState)
+		self.recordRateLimit(syncState)
 		db.session.commit()
 
-	# Process the details of a specific release and try to index it
-	def indexRelease(self, db: SQLAlchemy, releaseFragment: GitHubRelease):
+	# Fetch the list of releases off the BMD repo, dealing with the pagination of the list. Unless asked to fetch
+	# every page regardless, pages which have not changed since we last fetched them are skipped, as the releases
+	# on them have already been indexed
+	def fetchReleases(
+		self, db: SQLAlchemy, syncState: SyncState, conditional: bool = True
+	) -> Iterator[GitHubRelease]:
+		# Grab the validators we have for all the pages of the list in one go
+		validators = {
+			validator.uri: validator
+			for validator in db.session.scalars(
+				sql.select(APIValidator).where(APIValidator.uri.startswith(releasesURI))
+			)
+		}
+
+		# Fire off the request for the first page, which also tells us how many pages there are in total
+		response, releases = self.fetchReleasesPage(1, validators, conditional)
+		# Releases are listed newest first, so if the first page has not changed, no releases have been made
+		# since we last looked and we have nothing to do
+		if releases is None:
+			return
+		self.updateValidator(db, validators, releasesPageURI(1), response)
+		syncState.listingETag = response.headers.get('ETag')
+		yield from releases
+
+		# If there are more pages, the Link header tells us where the last one is
+		lastPage = response.links.get('last')
+		if lastPage is None:
+			return
+		pageCount = int(parse_qs(urlparse(lastPage['url']).query)['page'][0])
+
+		# Now we know how many there are, fetch the rest of the pages several at once, keeping them in order. Each
+		# page is parsed (and trimmed) as it arrives on the thread that fetched it, so the connections go straight
+		# back to the pool rather than sitting open until we get round to that page. Only so many pages get fetched
+		# ahead of the one being worked through, so however long the list gets, only those are held onto
+		with ThreadPoolExecutor(max_workers = self.maxConcurrentRequests) as executor:
+			pageNumbers = range(2, pageCount + 1)
+			fetchPage = withRequestPriority(lambda page: self.fetchReleasesPage(page, validators, conditional))
+			pages = deque(executor.submit(fetchPage, page) for page in pageNumbers[:self.maxConcurrentRequests])
+			for index, pageNumber in enumerate(pageNumbers):
+				page, releases = pages.popleft().result()
+				# Keep the next page coming while we work through this one
+				nextIndex = index + self.maxConcurrentRequests
+				if nextIndex < len(pageNumbers):
+					pages.append(executor.submit(fetchPage, pageNumbers[nextIndex]))
+				if releases is None:
+					continue
+				self.updateValidator(db, validators, releasesPageURI(pageNumber), page)
+				yield from releases
+
+	# Fetch a specific page of the releases list off the BMD repo, conditional on it having changed if asked
+	def fetchReleasesPage(
+		self, page: int, validators: dict[str, APIValidator], conditional: bool = True
+	) -> tuple[requests.Response, list[GitHubRelease] | None]:
+		uri = releasesPageURI(page)
+		validator = validators.get(uri)
+		if validator is None or not conditional:
+			return self.fetchReleasesListPage(uri)
+		return self.fetchReleasesListPage(uri, validator.etag, validator.lastModified)
+
+	# Fetch a page of the releases list, parsing the releases out of it as it arrives and closing the response once
+	# that's done, handing back the (closed) response along with the releases. If the page has not changed since
+	# we last fetched it, there are no releases to hand back
+	def fetchReleasesListPage(
+		self, uri: str, etag: str | None = None, lastModified: str | None = None
+	) -> tuple[requests.Response, list[GitHubRelease] | None]:
+		with self.conditionalGet(uri, etag, lastModified) as response:
+			if response.status_code == 304:
+				return response, None
+			return response, list(self.releasesInPage(response))
+
+	# Fetch a resource from the API, making the request conditional on it having changed if we have
+	# validators for it from a previous request - in which case the response may be a 304
+	def conditionalGet(self, uri: str, etag: str | None = None, lastModified: str | None = None) -> requests.Response:
+		headers = self.requestHeaders()
+		if etag is not None:
+			headers['If-None-Match'] = etag
+		if lastModified is not None:
+			headers['If-Modified-Since'] = lastModified
+
+		# Fire off the request with the API token and version specified, once the rate limiter lets us. If GitHub
+		# refuses it for going over a rate limit, try again once we're allowed to (or give up if that's too long)
+		while True:
+			self.rateLimiter.acquire()
+			# Stream the response so pages of the releases list can be parsed as they arrive
+			response = self.session.get(uri, headers = headers, stream = True)
+			if not self.rateLimiter.record(response):
+				break
+			response.close()
+		# Make sure the request actually worked before anyone tries to make use of the response, letting go of
+		# the connection if it did not
+		if not response.ok:
+			response.close()
+			response.raise_for_status()
+		return response
+
+	# Record the validators GitHub gave us for a resource, to be stored with the next commit
+	def updateValidator(
+		self, db: SQLAlchemy, validators: dict[str, APIValidator], uri: str, response: requests.Response
+	):
+		validator = validators.get(uri)
+		if validator is None:
+			validator = APIValidator(uri)
+			validators[uri] = validator
+			db.session.add(validator)
+		validator.etag = response.headers.get('ETag')
+		validator.lastModified = response.headers.get('Last-Modified')
+
+	# Process the details of a specific release and try to index it, returning whether it was newly indexed.
+	# If the caller already knows which release versions are indexed, it can tell us to save looking it up
+	def indexRelease(
+		self, db: SQLAlchemy, releaseFragment: GitHubRelease, indexedVersions: set[str] | None = None
+	) -> bool:
 		# Check and make sure this is an actually published release
 		if releaseFragment['draft']:
-			return
+			return False
 
 		# See if the release is already present in the database
 		releaseVersion = releaseFragment['tag_name']
-		release = db.session.scalar(sql.select(Release).where(Release.version == releaseVersion))
+		if indexedVersions is None:
+			indexed = db.session.scalar(sql.select(Release.id).where(Release.version == releaseVersion)) is not None
+		else:
+			indexed = releaseVersion in indexedVersions
+			indexedVersions.add(releaseVersion)
 		# If there is one present, we've already cached this one so skip it
-		if release is not None:
-			return
+		if indexed:
+			return False
 
 		# Otherwise, build a new Release object and add it to the database
 		release = Release(releaseVersion)
 		db.session.add(release)
 
-		# Now loop through the release assets
-		for asset in releaseFragment['assets']:
-			# If the asset is a build of BMDA or the firmware, we want to index that
-			name = asset['name']
-			# Firmware ends with .elf, BMDA with .zip and when the asset name does not contain 'source' in the name
-			if name.endswith('.elf') or (name.endswith('.zip') and 'source' not in name):
-				self.indexAsset(db, asset, release)
-
-		# Having built a list of all the assets by probe, go through and make sure the variant names,
-		# file names and friendly names are set appropriately (fixup for full -> common)
-		self.harmoniseDownloadNames(release)
+		# Now index all the release assets
+		self.indexAssets(db, releaseFragment['assets'], release)
+		return True
 
 	# Process the removal of a release from the published set
 	def unindexRelease(self, db: SQLAlchemy, releaseFragment: GitHubRelease):
@@ -111,33 +377,77 @@ class GitHubAPI:
 			db.session.delete(probe)
 		for download in release.bmdaDownloads:
 			db.session.delete(download)
+		# Make sure they're gone before any of them get indexed afresh, as a release can only have each probe once
+		db.session.flush()
 
 		# Now update the release version string
 		release.version = releaseFragment['tag_name']
 
-		# Now loop through the release assets to re-index them
-		for asset in releaseFragment['assets']:
+		# Now re-index all the release assets
+		self.indexAssets(db, releaseFragment['assets'], release)
+
+	# Process the assets from a release, turning them into firmware and BMDA downloads in the database
+	def indexAssets(self, db: SQLAlchemy, assets: list[GitHubAsset], release: Release):
+		# Keep track of the probes that have firmware in this release as we go
+		probes: dict[Probe, ReleaseProbe] = {}
+		bmdaAssets: list[tuple[GitHubAsset, TargetOS, TargetArch | None]] = []
+		# Loop through the release assets
+		for asset in assets:
 			# If the asset is a build of BMDA or the firmware, we want to index that
 			name = asset['name']
-			# Firmware ends with .elf, BMDA with .zip and when the asset name does not contain 'source' in the name
-			if name.endswith('.elf') or (name.endswith('.zip') and 'source' not in name):
-				self.indexAsset(db, asset, release)
+			# Firmware ends with .elf, so can be indexed straight away
+			if name.endswith('.elf'):
+				self.indexFirmware(db, asset, release, probes)
+			# BMDA ends with .zip when the asset name does not contain 'source' in the name, and has to be inspected
+			elif name.endswith('.zip') and 'source' not in name:
+				# Figure out what we can from the name of the asset first
+				bmdaTarget = self.parseBMDAName(asset, release.version)
+				if bmdaTarget is not None:
+					bmdaAssets.append((asset, *bmdaTarget))
+
+		# Look up what we already know about these BMDA archives from inspecting them previously, all in one go
+		inspections: dict[int, AssetInspection] = {
+			inspection.assetID: inspection
+			for inspection in db.session.scalars(
+				sql.select(AssetInspection).where(AssetInspection.assetID.in_(asset['id'] for asset, _, _ in bmdaAssets))
+			)
+		}
+		# Any archive we have not seen before, or which has changed since we did, has to be inspected
+		uninspected = [
+			(asset, targetArch) for asset, _, targetArch in bmdaAssets
+			if not self.inspectionCurrent(inspections.get(asset['id']), asset)
+		]
+
+		# Inspecting BMDA archives means downloading and digging through each, which is slow, so do that for all
+		# of them in parallel (up to a limit). Only once an inspection completes is the result put into the database
+		with ThreadPoolExecutor(max_workers = self.maxConcurrentDownloads) as executor:
+			inspect = withRequestPriority(lambda uninspected: self.inspectBMDA(*uninspected))
+			results = executor.map(inspect, uninspected)
+			for (asset, _), (bmdaFileName, detectedArch) in zip(uninspected, results):
+				inspections[asset['id']] = self.recordInspection(
+					db, inspections.get(asset['id']), asset, bmdaFileName, detectedArch
+				)
+
+		# Now index all the archives that turned out to be usable BMDA builds
+		for asset, targetOS, targetArch in bmdaAssets:
+			inspection = inspections[asset['id']]
+			# If we could not find a valid BMDA binary in the archive, skip it
+			if inspection.fileName is None:
+				continue
+			# If the name of the archive did not tell us the architecture, use the one the inspection found
+			if targetArch is None:
+				targetArch = inspection.targetArch
+				# If we did not get a supported architecture, skip it
+				if targetArch is None:
+					continue
+			self.indexBMDA(db, asset, release, targetOS, targetArch, inspection.fileName)
 
 		# Having built a list of all the assets by probe, go through and make sure the variant names,
 		# file names and friendly names are set appropriately (fixup for full -> common)
-		self.harmoniseDownloadNames(release)
-
-	# Process an asset from a release, and turn it into a firmware download in the database
-	def indexAsset(self, db: SQLAlchemy, asset: GitHubAsset, release: Release):
-		# Determine if this is firmware or BMDA
-		if asset['name'].endswith('.elf'):
-			self.indexFirmware(db, asset, release)
-		# Otherwise it's BMDA
-		else:
-			self.indexBMDA(db, asset, release)
+		self.harmoniseDownloadNames(release, probes)
 
 	# Index a firmware build into the database against a release
-	def indexFirmware(self, db: SQLAlchemy, asset: GitHubAsset, release: Release):
+	def indexFirmware(self, db: SQLAlchemy, asset: GitHubAsset, release: Release, probes: dict[Probe, ReleaseProbe]):
 		# Firmware ELF files have the general name form of:
 		# blackmagic-<probe>-<variant>-<release>.elf
 		# or blackmagic-<probe>-<release>.elf
@@ -161,8 +471,8 @@ class GitHubAPI:
 			variant = 'full'
 
 		# With the probe and variant established, try to find the probe in the
-		# database for the release (and add it if it's not)
-		releaseProbe = self.findProbe(db, release, Probe.fromString(probeName))
+		# ones we have for the release (and add it if it's not)
+		releaseProbe = self.findProbe(db, release, probes, Probe.fromString(probeName))
 		probe = releaseProbe.probe
 
 		# Now build a description of this firwmare download for that probe
@@ -178,18 +488,20 @@ class GitHubAPI:
 		# Finally, add it to the database now we're done defining it
 		db.session.add(firmwareDownload)
 
-	def indexBMDA(self, db: SQLAlchemy, asset: GitHubAsset, release: Release):
+	# Figure out which OS and (if possible) architecture a BMDA build is for from the name of its archive,
+	# returning None if the asset is not a BMDA build for this release
+	def parseBMDAName(self, asset: GitHubAsset, releaseVersion: str) -> tuple[TargetOS, TargetArch | None] | None:
 		# BMDA release files have the general name form of:
 		# blackmagic-<os>-<os-ver>-<arch>-<release>.zip
 		# Where the architecture and OS version are both optional and omitable.
 		# So, disecting these is a bit of a pain.. but here goes:
 		# Check that the end of the file name is actually the release name, and the start 'blackmagic-'
-		releaseName = release.version.replace('.', '_')
+		releaseName = releaseVersion.replace('.', '_')
 		fileNameSuffix = f'-{releaseName}.zip'
 		fileName = asset['name']
 		# If it does not, then we're done here..
 		if not fileName.startswith(fileNamePrefix) or not fileName.endswith(fileNameSuffix):
-			return
+			return None
 
 		# Now grab only the middle part of the file name, and tear it apart
 		nameParts = fileName[len(fileNamePrefix):-len(fileNameSuffix)].split('-')
@@ -198,8 +510,8 @@ class GitHubAPI:
 
 		# We now have a few options here.. the first is that the file name contains an OS version.. but
 		# it's actually easier to see if there's an architecture present, and pop that out till we run out
-		# of components - if we don't recover one, we have to download the zip file to temporary storage and
-		# tear the archive apart to figure out what it can be run on.
+		# of components - if we don't recover one, we have to tear the archive apart to figure out what it
+		# can be run on.
 		targetArch: TargetArch | None = None
 		for idx, part in enumerate(nameParts):
 			arch = TargetArch.fromString(part.lower())
@@ -208,60 +520,79 @@ class GitHubAPI:
 				nameParts.pop(idx)
 				break
 
-		# We have to download the file anyway to identify the BMDA executable, so get that done
-		archivePath = self.downloadBMDA(asset['browser_download_url'])
-		# Turn the archive into a ZipFile resource so we can read out the contents and figure out what the
-		# BMDA binary is actually named - which we have to do before we can further determine architecture
-		archive = ZipFile(archivePath, mode = 'r')
-		bmdaFileName = self.determineBMDAFileName(archive.infolist())
-		# If we could not find a valid name for the BMDA binary, we're done here..
-		if bmdaFileName is None:
-			archive.close()
-			archivePath.unlink(missing_ok = True)
-			return
-
-		# Now handle if we still don't know the target architecture of the binary
-		if targetArch is None:
-			# Extract the BMDA binary from the archive to be able to futz with it
-			bmdaFile = Path(archive.extract(bmdaFileName, path = '/tmp'))
-			# Get the file magic for it and figure out what architecture is represented
-			targetArch = self.determineBMDAArch(magic.from_file(bmdaFile).lower())
-			bmdaFile.unlink()
-			# If we did not get a supported architecture, we're done!
+		return targetOS, targetArch
+
+	# Inspect a BMDA archive to figure out what the BMDA binary in it is called and, if we don't already know it,
+	# what architecture the binary is for. This does not touch the database so is safe to run on many assets at once
+	def inspectBMDA(self, asset: GitHubAsset, targetArch: TargetArch | None) -> tuple[Path | None, TargetArch | None]:
+		# We have to look inside the archive to identify the BMDA executable, so open it up. Turn the archive into
+		# a ZipFile resource so we can read out the contents and figure out what the BMDA binary is actually named -
+		# which we have to do before we can further determine architecture
+		with self.downloadBMDA(asset['browser_download_url']) as archiveFile, ZipFile(archiveFile, mode = 'r') as archive:
+			bmdaFileName = self.determineBMDAFileName(archive.infolist())
+			# If we could not find a valid name for the BMDA binary, we're done here..
+			if bmdaFileName is None:
+				return None, None
+
+			# Now handle if we still don't know the target architecture of the binary
+			detectedArch: TargetArch | None = None
 			if targetArch is None:
-				archive.close()
-				archivePath.unlink(missing_ok = True)
-				return
-
+				# Read just the headers of the BMDA binary out of the archive and figure out what architecture they say
+				with archive.open(bmdaFileName) as bmdaFile:
+					detectedArch = executableArch(bmdaFile.read(executableHeaderSize))
+
+		return Path(bmdaFileName.filename), detectedArch
+
+	# Check if a previous inspection of an asset is still valid - it is if GitHub says the asset has not changed
+	def inspectionCurrent(self, inspection: AssetInspection | None, asset: GitHubAsset) -> bool:
+		return inspection is not None and inspection.size == asset['size'] and inspection.updatedAt == asset['updated_at']
+
+	# Record the results of inspecting an asset so we never need to do so again while it stays the same
+	def recordInspection(
+		self, db: SQLAlchemy, inspection: AssetInspection | None, asset: GitHubAsset, bmdaFileName: Path | None,
+		detectedArch: TargetArch | None
+	) -> AssetInspection:
+		if inspection is None:
+			inspection = AssetInspection(asset['id'])
+			db.session.add(inspection)
+		inspection.size = asset['size']
+		inspection.updatedAt = asset['updated_at']
+		inspection.fileName = bmdaFileName
+		inspection.targetArch = detectedArch
+		return inspection
+
+	# Index a BMDA build that has been inspected into the database against a release
+	def indexBMDA(
+		self, db: SQLAlchemy, asset: GitHubAsset, release: Release, targetOS: TargetOS, targetArch: TargetArch,
+		bmdaFileName: Path
+	):
 		# We now have all the moving pieces - turn the information we have into an entry in the database
 		binary = BMDABinary(release, targetOS, targetArch)
 		binary.uri = asset['browser_download_url']
-		binary.fileName = Path(bmdaFileName.filename)
+		binary.fileName = bmdaFileName
 
-		# When we get done, make sure to clean up the archive we downloaded
-		archive.close()
-		archivePath.unlink(missing_ok = True)
 		# Finally, add it to the database now we're done defining it
 		db.session.add(binary)
 
-	def findProbe(self, db: SQLAlchemy, release: Release, probe: Probe) -> ReleaseProbe:
-		# Check and see if this probe is already in the database for this release
-		releaseProbe = db.session.scalar(
-			sql.select(ReleaseProbe).where(ReleaseProbe.releaseID == release.id, ReleaseProbe.probe == probe)
-		)
+	def findProbe(
+		self, db: SQLAlchemy, release: Release, probes: dict[Probe, ReleaseProbe], probe: Probe
+	) -> ReleaseProbe:
+		# Check and see if we already have this probe for this release
+		releaseProbe = probes.get(probe)
 
-		# If it is, then return that
+		# If we do, then return that
 		if releaseProbe is not None:
 			return releaseProbe
 
-		# It was not, so make a new one, add it to the database and return
+		# We do not, so make a new one, add it to the database and return
 		releaseProbe = ReleaseProbe(release, probe)
+		probes[probe] = releaseProbe
 		db.session.add(releaseProbe)
 		return releaseProbe
 
-	def harmoniseDownloadNames(self, release: Release):
+	def harmoniseDownloadNames(self, release: Release, probes: dict[Probe, ReleaseProbe]):
 		# Loop through all the probes in the release
-		for releaseProbe in release.probeFirmware:
+		for releaseProbe in probes.values():
 			# If the probe only has one variant or none, skip
 			if len(releaseProbe.variants) <= 1:
 				continue
@@ -279,24 +610,32 @@ class GitHubAPI:
 				probeFriendlyName = 'BMP' if probe == Probe.native else probe.toString()
 				variant.friendlyName = f'Black Magic Debug for {probeFriendlyName} ({variantFriendlyName(variant.variantName)})'
 
-	def downloadBMDA(self, uri: str) -> Path:
-		# Figure out where stick this archive (use /tmp!)
-		downloadPath = Path('/tmp/blackmagic-bmda.zip')
-		# If it already exists, clean up - this means something went wrong in a previous run
-		if downloadPath.exists():
-			# TOCTOU: This could be cleaned up between the check and unlink, so allow it to have gone missing
-			downloadPath.unlink(missing_ok = True)
-
-		# Request the file from the GH servers streamed
-		response = requests.get(uri, stream = True)
-		with downloadPath.open('wb') as file:
-			# Pull the file contents back in 4KiB chunks
-			for chunk in response.iter_content(chunk_size = 4096):
-				# Write the chunk out, however big it winds up being
-				file.write(chunk)
-
-		# When all's said and done, return where we stuck the downloaded file
-		return downloadPath
+	def downloadBMDA(self, uri: str) -> BinaryIO:
+		# Start by asking the GH servers for just the tail end of the archive - if they honour that, we can
+		# read the archive remotely, only pulling the central directory and the bits of the members we look at
+		response = self.session.get(uri, headers = {'Range': f'bytes=-{remoteFileTailSize}'}, stream = True)
+		response.raise_for_status()
+		archive = RemoteFile.fromTailResponse(self.session, response)
+		if archive is not None:
+			return archive
+
+		# They did not, so if what we got back is not the whole file, ask again for it without the Range
+		if response.status_code != 200:
+			response.close()
+			response = self.session.get(uri, stream = True)
+			response.raise_for_status()
+
+		# Now pull the whole file down into temporary storage, which goes away as soon as it's closed. This is kept
+		# in memory unless it grows beyond our limit, in which case it spills out to a uniquely named file on disk
+		file = SpooledTemporaryFile(max_size = self.maxArchiveMemory, prefix = 'blackmagic-bmda-', suffix = '.zip')
+		# Pull the file contents back a chunk at a time
+		for chunk in response.iter_content(chunk_size = self.downloadChunkSize):
+			# Write the chunk out, however big it winds up being
+			file.write(chunk)
+
+		# When all's said and done, rewind the file so it's ready to be read
+		file.seek(0)
+		return file
 
 	def determineBMDAFileName(self, files: list[ZipInfo]) -> ZipInfo | None:
 		# Loop through each of the files in the zip file
@@ -321,19 +660,6 @@ class GitHubAPI:
 		# If we didn't find one, indicate that by returning None
 		return None
 
-	def determineBMDAArch(self, magic: str) -> TargetArch | None:
-		# If the file magic contains one of these substrings somewhere in it, we have an AMD64 binary (probably)
-		if 'x86-64' in magic or 'x86_64' in magic:
-			return TargetArch.amd64
-		# If the file magic contains i*86, we have an i386 binary (probably)
-		if 'i386' in magic or 'i486' in magic or 'i586' in magic or 'i686' in magic:
-			return TargetArch.i386
-		# If the file contains one of these substrings, we have an AArch64 binary for sure
-		if 'aarch64' in magic or 'arm64' in magic:
-			return TargetArch.aarch64
-
-		return None
-
 	# Handle a notification from GitHub that a release changed in some way.
 	# NB: Due to a limitation on GitHub's end, we cannot see updates to release assets
 	# being made unless they're accompanied by one of the change types release.edit
@@ -343,7 +669,9 @@ class GitHubAPI:
 	# ignoring it as we can manually fix things up in the index database, and the frequency
 	# of such changes is very low anyway. Once a release is made, we don't generally go
 	# changing the release assets if we can possibly help it.
-	def processReleaseWebhook(self, db: SQLAlchemy, request: Request, secret: bytes, cache: ETagCache):
+	def processReleaseWebhook(
+		self, request: Request, secret: bytes, enqueue: Callable[[str | None, GitHubReleaseWebhook, str], bool]
+	):
 		# Start by seeing if the request data matches the HMAC-SHA256 from the headers
 		reqSignature = request.headers.get('X-Hub-Signature-256')
 		# Validate that the signature has the correct form
@@ -359,25 +687,45 @@ class GitHubAPI:
 		if not compare_digest(reqSignature, bodySignature):
 			return 'Forbidden', 403
 
-		# Unpack the request as JSON now we know this is a request from GitHub
-		webhookRequest: GitHubReleaseWebhook | None = request.json
-		assert webhookRequest is not None
-
-		# We care about a few kinds of change, so dispatch accordingly
-		match webhookRequest['action']:
-			# If the release was newly directly created,
-			case 'created' | 'released' | 'prereleased' | 'published':
-				self.indexRelease(db, webhookRequest['release'])
-			# If the release is being edited
-			case 'edited':
-				assert webhookRequest['changes'] is not None
-				self.updateRelease(db, webhookRequest['release'], webhookRequest['changes'])
-			# If the release is being deleted
-			case 'deleted' | 'unpublished':
-				self.unindexRelease(db, webhookRequest['release'])
-
-		# Make sure any changes made in the handling of this notification have stuck
-		db.session.commit()
-		cache.invalidate(handlerName = 'metadata')
-		# If all went well, tell the GH server we handled things
-		return 'Processed', 200
+		# Make sure the request is JSON now we know this is a request from GitHub
+		webhookRequest: GitHubReleaseWebhook | None = request.get_json(silent = True)
+		if webhookRequest is None:
+			return 'Malformed request', 400
+
+		# Indexing a release can take a while (longer than GitHub will wait on us), so rather than handle the
+		# notification now, queue it up to be processed in the background and tell GitHub we've got it. If GitHub
+		# is re-delivering a notification we already have, there's nothing more to do
+		if not enqueue(request.headers.get('X-GitHub-Delivery'), webhookRequest, request.get_data(as_text = True)):
+			return 'Already received', 200
+		return 'Accepted', 202
+
+	# Process a burst of queued release webhook notifications, in the order they were received, returning the
+	# versions of the releases they were about. GitHub sends several notifications in quick succession for what
+	# is really one change (created, published, released..), but only the first of those does any indexing as
+	# after that the release is already indexed, and all the changes get committed together at the end
+	def processReleaseJobs(self, db: SQLAlchemy, webhookRequests: list[GitHubReleaseWebhook]) -> set[str]:
+		# Hold off the release sync writing to the index while we work on it
+		with self.indexLock:
+			versions: set[str] = set()
+			for webhookRequest in webhookRequests:
+				# Keep track of which release versions this notification is about
+				versions.add(webhookRequest['release']['tag_name'])
+				# We care about a few kinds of change, so dispatch accordingly
+				match webhookRequest['action']:
+					# If the release was newly directly created,
+					case 'created' | 'released' | 'prereleased' | 'published':
+						self.indexRelease(db, webhookRequest['release'])
+					# If the release is being edited
+					case 'edited':
+						assert webhookRequest['changes'] is not None
+						self.updateRelease(db, webhookRequest['release'], webhookRequest['changes'])
+						nameChange = webhookRequest['changes'].get('tag_name')
+						if nameChange is not None:
+							versions.add(nameChange['from'])
+					# If the release is being deleted
+					case 'deleted' | 'unpublished':
+						self.unindexRelease(db, webhookRequest['release'])
+
+			# Make sure any changes made in the handling of these notifications have stuck
+			db.session.commit()
+			return versions
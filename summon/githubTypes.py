@@ -162,7 +162,7 @@ class GitHubRelease(TypedDict):
 	draft: bool
 	prerelease: bool
 	created_at: str
-	published_at: str
+	published_at: str | None
 	author: GitHubUser
 	assets: list[GitHubAsset]
 
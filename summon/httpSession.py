@@ -0,0 +1,39 @@
+# SPDX-License-Identifier: BSD-3-Clause
+from requests import Response, Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+__all__ = (
+	'HTTPSession',
+)
+
+# Which response statuses indicate the server is having a bad time and the request is worth trying again
+retryStatuses = (500, 502, 503, 504)
+
+# Defines a HTTP session which keeps connections to each host alive and pooled between requests, retries
+# requests that fail on connection errors or server errors with an exponential backoff, and puts a limit on
+# how long any request can take to connect and to produce data, so a stalled server can't hang us forever
+class HTTPSession(Session):
+	def __init__(
+		self, poolSize: int, timeout: tuple[float, float], maxRetries: int, retryBackoff: float = 0.5
+	) -> None:
+		super().__init__()
+		# How long (in seconds) to wait for a connection, and then between bytes of the response
+		self.timeout = timeout
+		retries = Retry(
+			total = maxRetries,
+			status_forcelist = retryStatuses,
+			backoff_factor = retryBackoff,
+			allowed_methods = frozenset({'GET', 'HEAD'}),
+			# Let the last response through on running out of retries so the caller's raise_for_status() sees it
+			raise_on_status = False,
+		)
+		# Hold on to enough connections per host for everyone that might be making requests at once
+		adapter = HTTPAdapter(pool_maxsize = poolSize, max_retries = retries)
+		self.mount('https://', adapter)
+		self.mount('http://', adapter)
+
+	# Make a request, applying our timeouts unless the caller asked for something different
+	def request(self, method: str | bytes, url: str | bytes, *args, **kwargs) -> Response:
+		kwargs.setdefault('timeout', self.timeout)
+		return super().request(method, url, *args, **kwargs)
@@ -0,0 +1,82 @@
+# SPDX-License-Identifier: BSD-3-Clause
+from collections.abc import Iterable, Iterator
+from codecs import getincrementaldecoder
+from json import JSONDecoder, JSONDecodeError
+from typing import Any
+
+__all__ = (
+	'iterJSONArray',
+)
+
+# Matches the whitespace allowed between JSON values
+whitespace = ' \t\n\r'
+# And what can come right after an element of an array
+separators = whitespace + ',]'
+
+# Parse a JSON array as it arrives a chunk at a time, yielding each of its elements as soon as the whole of it is
+# in, so only one element (and whatever of the next has arrived) need ever be held in memory rather than the whole
+# array. Each element is itself decoded all in one go with the standard decoder
+def iterJSONArray(chunks: Iterable[bytes]) -> Iterator[Any]:
+	decoder = JSONDecoder()
+	textDecoder = getincrementaldecoder('utf-8')()
+	chunkIterator = iter(chunks)
+	buffer = ''
+	position = 0
+	finished = False
+
+	# Pull in the next chunk, dropping everything already parsed from the buffer, returning False if there is no more
+	def fill() -> bool:
+		nonlocal buffer, position, finished
+		if finished:
+			return False
+		chunk = next(chunkIterator, None)
+		if chunk is None:
+			finished = True
+			buffer = buffer[position:] + textDecoder.decode(b'', final = True)
+		else:
+			buffer = buffer[position:] + textDecoder.decode(chunk)
+		position = 0
+		return True
+
+	# Find the next thing in the array that isn't whitespace, pulling in more chunks as needed
+	def nextToken() -> str:
+		nonlocal position
+		while True:
+			while position < len(buffer) and buffer[position] in whitespace:
+				position += 1
+			if position < len(buffer):
+				return buffer[position]
+			if not fill():
+				raise JSONDecodeError('Unexpected end of data', buffer, position)
+
+	if nextToken() != '[':
+		raise JSONDecodeError('Expected an array', buffer, position)
+	position += 1
+	if nextToken() == ']':
+		return
+
+	while True:
+		nextToken()
+		# Try to decode the next element from what we have so far, pulling in more if we don't have all of it yet
+		while True:
+			try:
+				element, end = decoder.raw_decode(buffer, position)
+				# Make sure the element is followed by something that can come after it, otherwise it might carry on
+				# into the next chunk (such as a number that got split between chunks)
+				if finished or (end < len(buffer) and buffer[end] in separators):
+					break
+			except JSONDecodeError:
+				if finished:
+					raise
+			fill()
+		position = end
+		yield element
+
+		# Elements are followed either by a comma and another element, or the end of the array
+		match nextToken():
+			case ',':
+				position += 1
+			case ']':
+				return
+			case _:
+				raise JSONDecodeError("Expected ',' or ']'", buffer, position)
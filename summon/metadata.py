@@ -1,86 +1,166 @@
 # SPDX-License-Identifier: BSD-3-Clause
-from sqlalchemy import sql
+from sqlalchemy import sql, types
 
 from .models import SQLAlchemy, Release, ReleaseProbe, FirmwareDownload, BMDABinary
+from .types import Probe, TargetOS, TargetArch
+from .version import versionOrder
 
 __all__ = (
-	'releasesToJSON'
+	'metadataToJSON',
+	'releasesToJSON',
 )
 
-def releasesToJSON(db: SQLAlchemy) -> dict:
-	# Extract all the releases we have indexed in the database
-	releases = db.session.scalars(
-		sql.select(Release)
-	)
+# Lookup tables for turning the raw integer values of the enums stored in the database straight into
+# their serialised string forms, without having to go via building the enum value first
+probeNames = {probe.value: probe.toString() for probe in Probe}
+targetOSNames = {targetOS.value: targetOS.toString() for targetOS in TargetOS}
+targetArchNames = {targetArch.value: targetArch.toString() for targetArch in TargetArch}
+
+# Construct a schema-conforming JSON object from the releases in the database, optionally narrowed down
+# to just the parts a client is interested in (see releasesToJSON())
+def metadataToJSON(
+	db: SQLAlchemy, *, probe: Probe | None = None, targetOS: TargetOS | None = None,
+	targetArch: TargetArch | None = None, version: str | None = None, minVersion: str | None = None,
+	latest: int | None = None
+) -> dict:
+	return {
+		"$schema": "https://raw.githubusercontent.com/blackmagic-debug/bmputil/refs/heads/main/src/metadata/metadata.schema.json",
+		"version": 1,
+		"releases": releasesToJSON(
+			db, probe = probe, targetOS = targetOS, targetArch = targetArch, version = version,
+			minVersion = minVersion, latest = latest
+		)
+	}
 
+# Build the dictionary of releases, newest first, optionally filtered down to only the firmware for one probe,
+# only the BMDA binaries for one OS and/or architecture, and only a specific release, the releases from a
+# given version on, or the latest few releases (with firmware for the probe, if filtering on that)
+def releasesToJSON(
+	db: SQLAlchemy, *, probe: Probe | None = None, targetOS: TargetOS | None = None,
+	targetArch: TargetArch | None = None, version: str | None = None, minVersion: str | None = None,
+	latest: int | None = None
+) -> dict:
 	# Construct a new dictionary for holding releases in
 	result = {}
-	# Now iterate through the releases, filling in an entry for each in the dict
-	for release in releases:
-		# Filter out releases that contain no firmware
-		if len(release.probeFirmware) == 0:
-			continue
-
-		# Otherwise, convert the firwmare entry list into a suitable JSON object
-		firmwareDict = probeFirmwareToJSON(release.probeFirmware)
-		includesBMDA = len(release.bmdaDownloads) != 0
-		bmdaDict = bmdaDownloadsToJSON(release.bmdaDownloads)
-
-		# Add the release to the result set
-		result[release.version] = {
-			"includesBMDA": includesBMDA,
-			"firmware": firmwareDict,
-		}
-
-		# If this release includes BMDAs, then add the entry for that to the result dict
-		if includesBMDA:
-			result[release.version]['bmda'] = bmdaDict
-
+	# Work out which releases are wanted, if not all of them
+	releaseIDs = selectReleaseIDs(probe, version, minVersion, latest)
+	# Fill it in with the firmware for each release, which also determines which releases are listed
+	firmwareRowsToJSON(db, result, releaseIDs, probe)
+	# Then add the BMDA downloads for each of those releases
+	bmdaRowsToJSON(db, result, releaseIDs, targetOS, targetArch)
 	return result
 
-def probeFirmwareToJSON(probeFirmware: list[ReleaseProbe]) -> dict:
-	# Construct a new dictionary for holding firmware downloads by probe in
-	result = {}
-	# Iterate through all the probes with firmware in this release
-	for probeRelease in probeFirmware:
-		# Build a new dictionary holding all the variants for this probe
-		result[probeRelease.probe.toString()] = firmwareVariantsToJSON(probeRelease.variants)
-
-	return result
+# Build a query selecting the IDs of the releases wanted by the version filters given, or None if there are none
+def selectReleaseIDs(
+	probe: Probe | None, version: str | None, minVersion: str | None, latest: int | None
+) -> sql.Select | None:
+	if version is None and minVersion is None and latest is None:
+		return None
+
+	query = sql.select(Release.id)
+	if version is not None:
+		query = query.where(Release.version == version)
+	# The sortable form of the versions lets the database do the version comparisons and ordering for us
+	if minVersion is not None:
+		query = query.where(Release.versionOrder >= versionOrder(minVersion))
+	if latest is not None:
+		# Only count releases that will actually be listed, which are those with firmware (for the probe asked for)
+		hasFirmware = sql.select(ReleaseProbe.id).where(ReleaseProbe.releaseID == Release.id)
+		if probe is not None:
+			hasFirmware = hasFirmware.where(ReleaseProbe.probe == probe)
+		query = query.where(hasFirmware.exists()).order_by(Release.versionOrder.desc()).limit(latest)
+	return query
+
+def firmwareRowsToJSON(db: SQLAlchemy, result: dict, releaseIDs: sql.Select | None, probe: Probe | None):
+	# Extract all the firmware downloads we have indexed in the database as plain rows by joining from the
+	# releases through to the variants. The enum and path columns are type coerced so they come back as the raw
+	# integers and strings stored rather than being turned into IntEnums and Paths only to be turned back
+	# into strings again. Releases that contain no firmware (for the probe asked for, if any) get filtered out by the join.
+	query = (
+		sql.select(
+			Release.version,
+			sql.type_coerce(ReleaseProbe.probe, types.Integer()),
+			FirmwareDownload.variantName,
+			FirmwareDownload.friendlyName,
+			sql.type_coerce(FirmwareDownload.fileName, types.String()),
+			FirmwareDownload.uri,
+		)
+		.join(ReleaseProbe, ReleaseProbe.releaseID == Release.id)
+		.outerjoin(FirmwareDownload, FirmwareDownload.releaseFirmwareID == ReleaseProbe.id)
+		.order_by(Release.versionOrder.desc(), ReleaseProbe.id, FirmwareDownload.id)
+	)
+	if releaseIDs is not None:
+		query = query.where(Release.id.in_(releaseIDs))
+	if probe is not None:
+		query = query.where(ReleaseProbe.probe == probe)
+	rows = db.session.execute(query).tuples()
+
+	# Now iterate through the rows, filling in an entry for each release, probe and variant as we go
+	for version, probe, variantName, friendlyName, fileName, uri in rows:
+		# If this is the first row for this release, make a new entry for it in the result set
+		releaseDict = result.get(version)
+		if releaseDict is None:
+			releaseDict = {
+				"includesBMDA": False,
+				"firmware": {},
+			}
+			result[version] = releaseDict
+
+		# Find (or make) the dictionary holding all the variants for this probe
+		variantsDict = releaseDict['firmware'].setdefault(probeNames[probe], {})
+		# If the probe has no variants, there's nothing more to do for this row
+		if variantName is None:
+			continue
 
-def firmwareVariantsToJSON(variants: list[FirmwareDownload]) -> dict:
-	# Construct a new dictionary for holding firmware variants for a probe
-	result = {}
-	# Iterate through all the variants for this probe
-	for variant in variants:
 		# Build an object that describes this variant
-		result[variant.variantName] = {
-			"friendlyName": variant.friendlyName,
-			"fileName": str(variant.fileName),
-			"uri": variant.uri,
+		variantsDict[variantName] = {
+			"friendlyName": friendlyName,
+			"fileName": fileName,
+			"uri": uri,
 		}
 
-	return result
+def bmdaRowsToJSON(
+	db: SQLAlchemy, result: dict, releaseIDs: sql.Select | None, targetOS: TargetOS | None,
+	targetArch: TargetArch | None
+):
+	# Extract all the BMDA binaries we have indexed in the database (for the OS and architecture asked for,
+	# if any) as plain rows, much as for the firmware
+	query = (
+		sql.select(
+			Release.version,
+			sql.type_coerce(BMDABinary.targetOS, types.Integer()),
+			sql.type_coerce(BMDABinary.targetArch, types.Integer()),
+			sql.type_coerce(BMDABinary.fileName, types.String()),
+			BMDABinary.uri,
+		)
+		.join(BMDABinary, BMDABinary.releaseID == Release.id)
+		.order_by(Release.id, BMDABinary.id)
+	)
+	if releaseIDs is not None:
+		query = query.where(Release.id.in_(releaseIDs))
+	if targetOS is not None:
+		query = query.where(BMDABinary.targetOS == targetOS)
+	if targetArch is not None:
+		query = query.where(BMDABinary.targetArch == targetArch)
+	rows = db.session.execute(query).tuples()
 
-def bmdaDownloadsToJSON(bmdaDownloads: list[BMDABinary]) -> dict:
-	# Construct a new dictionary for holding the BMDA binaries in this release
-	result = {}
 	# Iterate through all the downloads available
-	for bmdaBinary in bmdaDownloads:
-		# Convert the target OS to a string and if that string does not yet exist in the result dictionary,
-		# make a new dictionary to hold the binaries for this OS
-		targetOS = bmdaBinary.targetOS.toString()
-		targetOSDict = result.setdefault(targetOS, {})
-
-		# Build a new dictionary holding an entry for the architecture of this BMDA binary
-		targetOSDict[bmdaBinary.targetArch.toString()] = bmdaBinaryToJSON(bmdaBinary)
+	for version, targetOS, targetArch, fileName, uri in rows:
+		# If the release was filtered out for not containing any firmware, skip the row
+		releaseDict = result.get(version)
+		if releaseDict is None:
+			continue
 
-	return result
+		# This release includes BMDAs, so mark it as such and find (or make) the entry holding them
+		releaseDict['includesBMDA'] = True
+		bmdaDict = releaseDict.setdefault('bmda', {})
+		# Convert the target OS to a string and if that string does not yet exist in the BMDA dictionary,
+		# make a new dictionary to hold the binaries for this OS
+		targetOSDict = bmdaDict.setdefault(targetOSNames[targetOS], {})
 
-def bmdaBinaryToJSON(binary: BMDABinary) -> dict:
-	# Construct a dictionary holding the information required for this BMDA binary to be downloaded
-	# and utilised successfully on a user's machine
-	return {
-		'fileName': str(binary.fileName),
-		'uri': binary.uri
-	}
+		# Build a new entry for the architecture of this BMDA binary holding the information required for
+		# it to be downloaded and utilised successfully on a user's machine
+		targetOSDict[targetArchNames[targetArch]] = {
+			'fileName': fileName,
+			'uri': uri,
+		}
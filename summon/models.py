@@ -1,11 +1,13 @@
 # SPDX-License-Identifier: BSD-3-Clause
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import ForeignKey, types
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, registry, relationship
+from sqlalchemy import Connection, ForeignKey, Index, inspect, sql, types
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, registry, relationship, validates
 from pathlib import Path
 from typing import NewType
+from logging import getLogger
 
 from .types import Probe, TargetOS, TargetArch, UnicodePath, intEnumMapper
+from .version import versionOrder
 
 __all__ = (
 	'db',
@@ -13,6 +15,11 @@ __all__ = (
 	'ReleaseProbe',
 	'FirmwareDownload',
 	'BMDABinary',
+	'APIValidator',
+	'AssetInspection',
+	'SyncState',
+	'WebhookJob',
+	'migrateSchema',
 )
 
 # Define types for mapping things in and out of the database cleanly
@@ -38,26 +45,40 @@ db = SQLAlchemy(model_class = Model)
 
 # Releases of BMD that have been made
 class Release(db.Model):
-	id: Mapped[i32] = mapped_column(primary_key = True, autoincrement = True, unique = True)
-	version: Mapped[str]
+	id: Mapped[i32] = mapped_column(primary_key = True, autoincrement = True)
+	# Releases are always looked up by their version, and there must only ever be one of each
+	version: Mapped[str] = mapped_column(index = True, unique = True)
+	# The version in a form that sorts semantically (see versionOrder()), so the database can put releases in
+	# order and find the latest. This is kept up to date automatically whenever the version is set
+	versionOrder: Mapped[str] = mapped_column(index = True)
 
-	probeFirmware: Mapped[list['ReleaseProbe']] = relationship(back_populates = 'release')
-	bmdaDownloads: Mapped[list['BMDABinary']] = relationship(back_populates = 'release')
+	probeFirmware: Mapped[list['ReleaseProbe']] = relationship(back_populates = 'release', cascade = 'all, delete-orphan')
+	bmdaDownloads: Mapped[list['BMDABinary']] = relationship(back_populates = 'release', cascade = 'all, delete-orphan')
 
 	def __init__(self, version: str):
 		self.version = version
 
+	@validates('version')
+	def updateVersionOrder(self, key: str, version: str) -> str:
+		self.versionOrder = versionOrder(version)
+		return version
+
 	def __repr__(self) -> str:
 		return f'<Release: {self.version}>'
 
 # Firmware in a release by probe platform
 class ReleaseProbe(db.Model):
-	id: Mapped[i64] = mapped_column(primary_key = True, autoincrement = True, unique = True)
+	# Each probe appears only once per release, and this also serves as the index for the foreign key
+	__table_args__ = (
+		Index('ix_release_probe_releaseID_probe', 'releaseID', 'probe', unique = True),
+	)
+
+	id: Mapped[i64] = mapped_column(primary_key = True, autoincrement = True)
 	releaseID: Mapped[i32] = mapped_column(ForeignKey(Release.id))
 	probe: Mapped[Probe]
 
 	release: Mapped[Release] = relationship(back_populates = 'probeFirmware')
-	variants: Mapped[list['FirmwareDownload']] = relationship(back_populates = 'probe')
+	variants: Mapped[list['FirmwareDownload']] = relationship(back_populates = 'probe', cascade = 'all, delete-orphan')
 
 	def __init__(self, release: Release, probe: Probe | str):
 		self.release = release
@@ -71,8 +92,8 @@ class ReleaseProbe(db.Model):
 
 # Downloads for firmware available for a probe
 class FirmwareDownload(db.Model):
-	id: Mapped[i64] = mapped_column(primary_key = True, autoincrement = True, unique = True)
-	releaseFirmwareID: Mapped[i64] = mapped_column(ForeignKey(ReleaseProbe.id))
+	id: Mapped[i64] = mapped_column(primary_key = True, autoincrement = True)
+	releaseFirmwareID: Mapped[i64] = mapped_column(ForeignKey(ReleaseProbe.id), index = True)
 	friendlyName: Mapped[str]
 	# This fileName is the name of the file the firmware is to be written into on the
 	# user's system as part of the firmware cache to uniquely identify the firmware
@@ -92,7 +113,12 @@ class FirmwareDownload(db.Model):
 
 # Downloads for zip files containing BMDA binaries
 class BMDABinary(db.Model):
-	id: Mapped[i64] = mapped_column(primary_key = True, autoincrement = True, unique = True)
+	# Index the binaries by the release and platform they're for, which also serves as the index for the foreign key
+	__table_args__ = (
+		Index('ix_bmda_binary_releaseID_targetOS_targetArch', 'releaseID', 'targetOS', 'targetArch'),
+	)
+
+	id: Mapped[i64] = mapped_column(primary_key = True, autoincrement = True)
 	releaseID: Mapped[i32] = mapped_column(ForeignKey(Release.id))
 	targetOS: Mapped[TargetOS]
 	targetArch: Mapped[TargetArch]
@@ -110,3 +136,176 @@ class BMDABinary(db.Model):
 
 	def __repr__(self) -> str:
 		return f'<BMDABinary: runs on {self.targetOS!r} ({self.targetArch!r}) for {self.release.version}>'
+
+# Cache validators (ETag and Last-Modified) GitHub gave us for an API resource, so that the next request
+# for it can be made conditional and skipped if nothing changed
+class APIValidator(db.Model):
+	id: Mapped[i32] = mapped_column(primary_key = True, autoincrement = True)
+	uri: Mapped[str] = mapped_column(unique = True)
+	etag: Mapped[str | None]
+	lastModified: Mapped[str | None]
+
+	def __init__(self, uri: str):
+		self.uri = uri
+
+	def __repr__(self) -> str:
+		return f'<APIValidator: {self.etag} for {self.uri}>'
+
+# Results of inspecting a BMDA archive asset from a release, keyed by GitHub's identity for the asset so that
+# the archive never needs fetching again while it remains unchanged
+class AssetInspection(db.Model):
+	id: Mapped[i32] = mapped_column(primary_key = True, autoincrement = True)
+	assetID: Mapped[i64] = mapped_column(unique = True)
+	size: Mapped[i64]
+	updatedAt: Mapped[str]
+	# The name of the BMDA binary found in the archive, or None if the archive does not contain one
+	fileName: Mapped[Path | None]
+	# The architecture the binary was found to be for, if it had to be determined from the binary itself
+	targetArch: Mapped[TargetArch | None]
+
+	def __init__(self, assetID: int):
+		self.assetID = assetID
+
+	def __repr__(self) -> str:
+		return f'<AssetInspection: {self.fileName} ({self.targetArch!r}) for asset {self.assetID}>'
+
+# How far through the list of releases on GitHub we have synced to, so a sync need only look at releases newer
+# than these. There is only ever one row in this table
+class SyncState(db.Model):
+	id: Mapped[i32] = mapped_column(primary_key = True, autoincrement = True)
+	# When the most recently published release we've seen was published (which is what the sync goes by), and
+	# the ID GitHub gives that release
+	newestReleaseID: Mapped[i64 | None]
+	newestPublishedAt: Mapped[str | None]
+	# The ETag of the first page of the list of releases when we last looked at it
+	listingETag: Mapped[str | None]
+	# What our GitHub API budget was the last time we looked, how much of it was left, and when it resets
+	rateLimit: Mapped[i32 | None]
+	rateLimitRemaining: Mapped[i32 | None]
+	rateLimitResetAt: Mapped[float | None]
+
+	def __repr__(self) -> str:
+		return f'<SyncState: up to release {self.newestReleaseID} published {self.newestPublishedAt}>'
+
+# Release webhook notifications from GitHub waiting to be processed, so the webhook itself can be answered
+# straight away rather than GitHub being kept waiting while the release gets indexed
+class WebhookJob(db.Model):
+	id: Mapped[i32] = mapped_column(primary_key = True, autoincrement = True)
+	# The ID GitHub gave the delivery of the notification, so re-deliveries of it can be spotted
+	deliveryID: Mapped[str | None] = mapped_column(index = True, unique = True)
+	# The ID GitHub gives the release the notification is about, so bursts of notifications about the same
+	# release can be processed together
+	releaseID: Mapped[i64 | None] = mapped_column(index = True)
+	# The notification's JSON payload, exactly as GitHub sent it
+	payload: Mapped[str] = mapped_column(types.Text)
+	# When (as a UNIX timestamp) the job was received, which bounds how long later ones can keep holding it back
+	createdAt: Mapped[float]
+	# When (as a UNIX timestamp) the job is next due to be run, which gets pushed back each time it is tried
+	dueAt: Mapped[float] = mapped_column(index = True)
+	# The token of whoever last claimed the job to process it, so they can pick out exactly the jobs they claimed
+	claimToken: Mapped[str | None] = mapped_column(index = True)
+	attempts: Mapped[i32]
+	# Why the job failed the last time it was tried, and if it has failed too many times to try again
+	lastError: Mapped[str | None] = mapped_column(types.Text)
+	failed: Mapped[bool]
+	# When the job was completed - completed jobs are kept for a while to remember which deliveries we've had
+	completedAt: Mapped[float | None]
+
+	def __init__(self, deliveryID: str | None, releaseID: int | None, payload: str, createdAt: float, dueAt: float):
+		self.deliveryID = deliveryID
+		self.releaseID = releaseID
+		self.payload = payload
+		self.createdAt = createdAt
+		self.dueAt = dueAt
+		self.attempts = 0
+		self.failed = False
+
+	def __repr__(self) -> str:
+		return f'<WebhookJob: {self.id} due at {self.dueAt} after {self.attempts} attempts>'
+
+logger = getLogger(__name__)
+
+# Get rid of any duplicate releases, and probes within releases, left behind from before there were unique indexes
+# on them (such as by renaming a release to the version of one already indexed), keeping whichever got indexed
+# first, so those unique indexes can be made. Only needs doing if the indexes aren't there already
+def removeDuplicates(connection: Connection, existingIndexes: set[str]):
+	firmwareTable = FirmwareDownload.__table__
+	probeTable = ReleaseProbe.__table__
+	bmdaTable = BMDABinary.__table__
+	releaseTable = Release.__table__
+
+	if 'ix_release_version' not in existingIndexes:
+		firstReleases = (
+			sql.select(sql.func.min(releaseTable.c.id)).group_by(releaseTable.c.version).scalar_subquery()
+		)
+		duplicateReleaseIDs = connection.scalars(
+			sql.select(releaseTable.c.id).where(releaseTable.c.id.not_in(firstReleases))
+		).all()
+		if len(duplicateReleaseIDs) != 0:
+			duplicateProbeIDs = sql.select(probeTable.c.id).where(probeTable.c.releaseID.in_(duplicateReleaseIDs))
+			connection.execute(sql.delete(firmwareTable).where(firmwareTable.c.releaseFirmwareID.in_(duplicateProbeIDs)))
+			connection.execute(sql.delete(probeTable).where(probeTable.c.releaseID.in_(duplicateReleaseIDs)))
+			connection.execute(sql.delete(bmdaTable).where(bmdaTable.c.releaseID.in_(duplicateReleaseIDs)))
+			connection.execute(sql.delete(releaseTable).where(releaseTable.c.id.in_(duplicateReleaseIDs)))
+			logger.warning(
+				f'Removed {len(duplicateReleaseIDs)} duplicate releases from the index, '
+				'run a full reindex to make sure the remaining ones are up to date'
+			)
+
+	if 'ix_release_probe_releaseID_probe' not in existingIndexes:
+		firstProbes = (
+			sql.select(sql.func.min(probeTable.c.id))
+			.group_by(probeTable.c.releaseID, probeTable.c.probe)
+			.scalar_subquery()
+		)
+		duplicateProbeIDs = connection.scalars(
+			sql.select(probeTable.c.id).where(probeTable.c.id.not_in(firstProbes))
+		).all()
+		if len(duplicateProbeIDs) != 0:
+			connection.execute(sql.delete(firmwareTable).where(firmwareTable.c.releaseFirmwareID.in_(duplicateProbeIDs)))
+			connection.execute(sql.delete(probeTable).where(probeTable.c.id.in_(duplicateProbeIDs)))
+			logger.warning(
+				f'Removed {len(duplicateProbeIDs)} duplicate release probes from the index, '
+				'run a full reindex to make sure the remaining ones are up to date'
+			)
+
+# Bring the schema of an existing database up to date with the models. create_all() only makes the tables
+# that don't exist yet, so this takes care of the columns and indexes added to tables since they were first made
+def migrateSchema(db: SQLAlchemy):
+	with db.engine.begin() as connection:
+		inspector = inspect(connection)
+		quote = connection.dialect.identifier_preparer.quote
+
+		# Releases gained the sortable form of their version, so add that and fill it in for existing releases
+		releaseTable = Release.__table__
+		if 'versionOrder' not in {column['name'] for column in inspector.get_columns(releaseTable.name)}:
+			connection.execute(
+				sql.text(
+					f'ALTER TABLE {quote(releaseTable.name)} ADD COLUMN {quote("versionOrder")} '
+					"VARCHAR NOT NULL DEFAULT ''"
+				)
+			)
+			for releaseID, version in connection.execute(sql.select(Release.id, Release.version)).all():
+				connection.execute(
+					sql.update(Release).where(Release.id == releaseID).values(versionOrder = versionOrder(version))
+				)
+
+		# Before making the unique indexes, make sure there's nothing in the way of them
+		existingIndexes = {
+			index['name'] for table in db.metadata.sorted_tables for index in inspector.get_indexes(table.name)
+		}
+		removeDuplicates(connection, existingIndexes)
+		for table in db.metadata.sorted_tables:
+			for index in table.indexes:
+				index.create(connection, checkfirst = True)
+
+		# Primary keys used to also be marked unique, which for everything but SQLite (where the index
+		# can't be dropped without rebuilding the table) made a second, redundant, index on them - drop those
+		if connection.dialect.name == 'sqlite':
+			return
+		for table in db.metadata.sorted_tables:
+			for constraint in inspector.get_unique_constraints(table.name):
+				if constraint['column_names'] == ['id']:
+					connection.execute(
+						sql.text(f'ALTER TABLE {quote(table.name)} DROP CONSTRAINT {quote(constraint["name"])}')
+					)
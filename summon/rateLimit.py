@@ -0,0 +1,166 @@
+# SPDX-License-Identifier: BSD-3-Clause
+from requests import Response
+from collections import Counter
+from collections.abc import Callable
+from contextvars import ContextVar, copy_context
+from enum import IntEnum
+from threading import Condition
+from time import ctime, time
+from typing import ParamSpec, TypeVar
+
+__all__ = (
+	'Priority',
+	'requestPriority',
+	'withRequestPriority',
+	'RateLimitExceeded',
+	'RateLimiter',
+)
+
+# How long to back off for when GitHub tells us we've hit a secondary rate limit without saying how long for
+secondaryLimitBackoff = 60
+
+# How important the work a request is being made for is - webhook notifications are someone waiting on a change
+# they just made to show up, whereas background syncs are only catching up on anything missed
+class Priority(IntEnum):
+	background = 0
+	webhook = 1
+
+# The priority of the requests being made by whatever is currently running, so the work being done doesn't have
+# to pass it down through everything between it and the requests it results in
+requestPriority: ContextVar[Priority] = ContextVar('requestPriority', default = Priority.background)
+
+P = ParamSpec('P')
+R = TypeVar('R')
+
+# Wrap a function to be run on other threads (such as by an executor) so the requests it makes keep the priority
+# of whatever handed it off, rather than the default one of the thread it winds up running on. Each call gets its
+# own copy of the context, as one context can't be in use on more than one thread at once
+def withRequestPriority(function: Callable[P, R]) -> Callable[P, R]:
+	context = copy_context()
+	def run(*args: P.args, **kwargs: P.kwargs) -> R:
+		return context.copy().run(function, *args, **kwargs)
+	return run
+
+class RateLimitExceeded(Exception):
+	def __init__(self, limit: int | None, resumeAt: float) -> None:
+		message = f'GitHub API rate limit exhausted until {ctime(resumeAt)}'
+		# The unauthenticated limit is tiny, so if that's the one we've hit, it's probably a missing token
+		if limit is not None and limit <= 60:
+			message += f' (only {limit} requests per hour allowed, is GITHUB_API_TOKEN set?)'
+		super().__init__(message)
+		self.resumeAt = resumeAt
+
+# Defines the scheduler all requests to the GitHub API go through, which keeps track of how much of our API
+# budget is left from the rate limit headers on the responses. Requests get held back while GitHub has told us
+# to back off, or the budget is used up, with background work leaving a reserve of the budget for webhook work,
+# giving way to any webhook work waiting to go, and having its requests spread out when the budget runs low.
+# Rather than hold up the thread it's on for a long time (which might have webhooks to get on with), a request
+# which would have to wait more than a little while fails with RateLimitExceeded instead
+class RateLimiter:
+	def __init__(self, reserve: int = 50, maxWait: float = 60, minInterval: float = 0.1) -> None:
+		self.condition = Condition()
+		# What GitHub last told us our budget is, how much of it is left, and when (as a UNIX timestamp) it resets
+		self.limit: int | None = None
+		self.remaining: int | None = None
+		self.resetAt: float | None = None
+		# When GitHub said we can start making requests again after telling us to back off
+		self.pausedUntil = 0.0
+		# When the next request may be made, so requests are kept from all going at once
+		self.nextRequestAt = 0.0
+		# How many requests of each priority are waiting to go
+		self.waiting: Counter[Priority] = Counter()
+		# How much of the budget background work must leave for webhook work
+		self.reserve = reserve
+		# How long (in seconds) a request is allowed to wait for before giving up
+		self.maxWait = maxWait
+		# And the least amount of time (in seconds) to leave between requests
+		self.minInterval = minInterval
+
+	# Wait until a request of the current priority is allowed to be made, and space the next out from it. What
+	# the request costs is left to record() to find out from the response, as those GitHub answers with a 304
+	# don't count against the budget at all
+	def acquire(self):
+		priority = requestPriority.get()
+		with self.condition:
+			self.waiting[priority] += 1
+			try:
+				while True:
+					now = time()
+					readyAt = self.readyAt(priority, now)
+					if readyAt - now > self.maxWait:
+						raise RateLimitExceeded(self.limit, readyAt)
+					if readyAt <= now and not self.outranked(priority):
+						break
+					self.condition.wait(max(readyAt - now, self.minInterval))
+				self.nextRequestAt = now + self.interval(priority, now)
+			finally:
+				self.waiting[priority] -= 1
+				self.condition.notify_all()
+
+	# Take note of the rate limit state GitHub sent back on a response, returning whether the request got
+	# refused because of a rate limit (in which case it is worth making again once we're allowed to)
+	def record(self, response: Response) -> bool:
+		headers = response.headers
+		now = time()
+		with self.condition:
+			if 'X-RateLimit-Remaining' in headers and 'X-RateLimit-Reset' in headers:
+				remaining = int(headers['X-RateLimit-Remaining'])
+				resetAt = float(headers['X-RateLimit-Reset'])
+				# Responses to requests made at once can come back in any order, so within the same window,
+				# believe whichever says the least budget is left
+				if self.resetAt == resetAt and self.remaining is not None:
+					remaining = min(remaining, self.remaining)
+				self.limit = int(headers.get('X-RateLimit-Limit', remaining))
+				self.remaining = remaining
+				self.resetAt = resetAt
+
+			rateLimited = False
+			if response.status_code in (403, 429):
+				retryAfter = headers.get('Retry-After')
+				if retryAfter is not None and retryAfter.isdigit():
+					self.pausedUntil = max(self.pausedUntil, now + int(retryAfter))
+					rateLimited = True
+				elif headers.get('X-RateLimit-Remaining') == '0' and self.resetAt is not None:
+					self.pausedUntil = max(self.pausedUntil, self.resetAt)
+					rateLimited = True
+				# A 429 with nothing to go on is a secondary rate limit, for which GitHub says to wait at least a minute
+				elif response.status_code == 429:
+					self.pausedUntil = max(self.pausedUntil, now + secondaryLimitBackoff)
+					rateLimited = True
+			self.condition.notify_all()
+		return rateLimited
+
+	# Get the current state of the budget as what it is, how much of it is left and when it resets
+	def budget(self) -> tuple[int | None, int | None, float | None]:
+		with self.condition:
+			return self.limit, self.remaining, self.resetAt
+
+	# How much of the budget requests of the given priority have to leave alone
+	def reserveFor(self, priority: Priority) -> int:
+		if priority == Priority.webhook or self.limit is None:
+			return 0
+		# Don't reserve more than a quarter of the budget, which matters when it's the tiny unauthenticated one
+		return min(self.reserve, self.limit // 4)
+
+	# Work out when a request of the given priority is next allowed to be made
+	def readyAt(self, priority: Priority, now: float) -> float:
+		readyAt = max(self.pausedUntil, self.nextRequestAt)
+		if self.remaining is not None and self.resetAt is not None and now < self.resetAt:
+			if self.remaining <= self.reserveFor(priority):
+				readyAt = max(readyAt, self.resetAt)
+		return readyAt
+
+	# Check if there's more important work waiting to go that a request of the given priority should give way to
+	def outranked(self, priority: Priority) -> bool:
+		return any(count > 0 for waitingPriority, count in self.waiting.items() if waitingPriority > priority)
+
+	# Work out how long to leave after a request of the given priority before the next. Once the budget runs low,
+	# background requests get spread out over the time left until it resets rather than using it all up at once
+	def interval(self, priority: Priority, now: float) -> float:
+		if (
+			priority == Priority.background and self.limit is not None and self.remaining is not None and
+			self.resetAt is not None and self.remaining < self.limit // 4 and now < self.resetAt
+		):
+			available = max(self.remaining - self.reserveFor(priority), 1)
+			return max(self.minInterval, (self.resetAt - now) / available)
+		return self.minInterval
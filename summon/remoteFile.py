@@ -0,0 +1,123 @@
+# SPDX-License-Identifier: BSD-3-Clause
+from io import RawIOBase, SEEK_SET, SEEK_CUR, SEEK_END
+import requests
+
+__all__ = (
+	'RemoteFile',
+)
+
+# How much of the end of a file to ask for up front - for a zip archive this is enough to hold the
+# end of central directory record and, for archives with only a handful of members, the central directory too
+tailSize = 8 * 1024
+# The minimum amount to fetch whenever a read needs data we've not got yet, so small sequential reads
+# (such as those ZipFile does) don't each turn into their own request
+readAheadSize = 16 * 1024
+# How much of the file we're willing to hold in memory, beyond which the spans fetched least recently get dropped
+maxCachedSize = 1024 * 1024
+
+# Pick apart the Content-Range header of a response to a Range request - 'bytes <start>-<end>/<size>' - into
+# the start and end (inclusive) of the span of the file in the response and the size of the whole file, or
+# None if the header is missing or not something we understand
+def parseContentRange(response: requests.Response) -> tuple[int, int, int] | None:
+	contentRange = response.headers.get('Content-Range', '')
+	unit, _, span = contentRange.partition(' ')
+	byteRange, _, size = span.partition('/')
+	start, _, end = byteRange.partition('-')
+	if unit != 'bytes' or not start.isdigit() or not end.isdigit() or not size.isdigit():
+		return None
+	return int(start), int(end), int(size)
+
+# Defines a read-only, seekable file that lives on a HTTP server which supports Range requests, fetching
+# only the parts of the file that actually get read (such as the central directory of a zip archive and the
+# start of one member of it) rather than the whole thing
+class RemoteFile(RawIOBase):
+	def __init__(self, session: requests.Session, uri: str, size: int, start: int, data: bytes) -> None:
+		super().__init__()
+		# The session to make requests for more of the file through
+		self.session = session
+		self.uri = uri
+		self.size = size
+		self.position = 0
+		# Keep track of which spans of the file we have fetched, starting with the one we were given
+		self.spans: list[tuple[int, bytes]] = [(start, data)]
+		# And how many bytes we've pulled off the server in total
+		self.bytesFetched = len(data)
+
+	# Try to turn a response to a request for the tail of a file (`Range: bytes=-N`) into a RemoteFile,
+	# returning None if the server did not honour the Range request
+	@staticmethod
+	def fromTailResponse(session: requests.Session, response: requests.Response) -> 'RemoteFile | None':
+		if response.status_code != 206:
+			return None
+		# Content-Range tells us where in the file we got and how big the whole file is
+		contentRange = parseContentRange(response)
+		if contentRange is None:
+			return None
+		start, _, size = contentRange
+		# Make use of the URI we wound up at after any redirects so we don't go through them again for every read
+		return RemoteFile(session, response.url, size, start, response.content)
+
+	def readable(self) -> bool:
+		return True
+
+	def seekable(self) -> bool:
+		return True
+
+	def tell(self) -> int:
+		return self.position
+
+	def seek(self, offset: int, whence: int = SEEK_SET) -> int:
+		if whence == SEEK_SET:
+			position = offset
+		elif whence == SEEK_CUR:
+			position = self.position + offset
+		elif whence == SEEK_END:
+			position = self.size + offset
+		else:
+			raise ValueError(f'Invalid whence {whence}')
+		if position < 0:
+			raise ValueError('Negative seek position')
+		self.position = position
+		return position
+
+	def readinto(self, buffer) -> int:
+		# Work out how much we can actually read from where we are
+		length = min(len(buffer), self.size - self.position)
+		if length <= 0:
+			return 0
+		data = self.fetch(self.position, length)
+		buffer[:length] = data
+		self.position += length
+		return length
+
+	# Get a span of the file, either from what we already have or from the server
+	def fetch(self, start: int, length: int) -> bytes:
+		# See if one of the spans we have already covers what's wanted, and use it if so
+		for spanStart, spanData in self.spans:
+			if spanStart <= start and start + length <= spanStart + len(spanData):
+				offset = start - spanStart
+				return spanData[offset:offset + length]
+
+		# We don't, so ask the server for it, reading ahead a bit so the next few small reads are already here
+		end = min(start + max(length, readAheadSize), self.size) - 1
+		response = self.session.get(self.uri, headers = {'Range': f'bytes={start}-{end}'})
+		response.raise_for_status()
+		if response.status_code != 206:
+			raise OSError(f'Server did not honour Range request for {self.uri}')
+		# Make sure we got the span we asked for (or at least enough of it, from the right place), as otherwise
+		# we'd be handing back the wrong bytes of the file
+		data = response.content
+		contentRange = parseContentRange(response)
+		if contentRange is None or contentRange[0] != start or len(data) != contentRange[1] - start + 1:
+			raise OSError(f'Server sent back a different span of {self.uri} than asked for')
+		if len(data) < length:
+			raise OSError(f'Server sent back less of {self.uri} than asked for')
+		self.spans.append((start, data))
+		self.bytesFetched += len(data)
+
+		# If we're now holding too much, drop the oldest spans until we're back under the limit
+		cachedSize = sum(len(spanData) for _, spanData in self.spans)
+		while cachedSize > maxCachedSize and len(self.spans) > 1:
+			_, spanData = self.spans.pop(0)
+			cachedSize -= len(spanData)
+		return data[:length]
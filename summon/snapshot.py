@@ -0,0 +1,48 @@
+# SPDX-License-Identifier: BSD-3-Clause
+from flask import current_app
+from flask_sqlalchemy import SQLAlchemy
+from pathlib import Path
+from hashlib import sha256
+from tempfile import NamedTemporaryFile
+import os
+
+from .metadata import metadataToJSON
+from .etag import encoders
+
+__all__ = (
+	'writeSnapshot',
+)
+
+# The file suffixes front-end servers look for precompressed siblings of a file under, by content encoding
+encodingSuffixes = {
+	'gzip': '.gz',
+	'br': '.br',
+	'zstd': '.zst',
+}
+
+# Render the metadata.json payload and write it out to a directory as a static snapshot, along with precompressed
+# siblings of it and a sidecar holding its ETag, so a front-end server such as nginx can serve it directly
+def writeSnapshot(db: SQLAlchemy, directory: Path):
+	# Render the payload exactly as the metadata endpoint would, so the content and ETag match what it serves
+	data = current_app.json.response(metadataToJSON(db)).get_data()
+	directory.mkdir(parents = True, exist_ok = True)
+	snapshotPath = directory / 'metadata.json'
+
+	# Write the precompressed siblings and the ETag out first, so by the time the new snapshot itself
+	# appears, everything that goes with it is already in place
+	for encoding, encoder in encoders.items():
+		writeAtomically(snapshotPath.with_name(f'{snapshotPath.name}{encodingSuffixes[encoding]}'), encoder(data))
+	writeAtomically(snapshotPath.with_name(f'{snapshotPath.name}.etag'), f'"{sha256(data).hexdigest()}"'.encode())
+	writeAtomically(snapshotPath, data)
+
+# Write a file such that anything reading it sees either the old contents or the new, never a partial write
+def writeAtomically(path: Path, data: bytes):
+	# Write the data to a temporary file alongside the target so the rename below stays on one filesystem
+	with NamedTemporaryFile(dir = path.parent, prefix = f'.{path.name}.', delete = False) as file:
+		file.write(data)
+		file.flush()
+		os.fsync(file.fileno())
+	# Make it readable by the front-end server, then swap it into place
+	tempPath = Path(file.name)
+	tempPath.chmod(0o644)
+	tempPath.replace(path)
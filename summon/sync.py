@@ -0,0 +1,106 @@
+# SPDX-License-Identifier: BSD-3-Clause
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from collections.abc import Callable
+from pathlib import Path
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import TextIO
+import fcntl
+
+from .github import GitHubAPI
+from .webhooks import WebhookQueue
+from .rateLimit import RateLimitExceeded
+
+__all__ = (
+	'ReleaseSync',
+)
+
+# Defines a background job which periodically syncs the release index with GitHub. Every worker process runs one
+# of these, but only the one which holds the lock on the sync lock file (the leader) actually does any syncing.
+# If the leader goes away, its lock is released and the next worker to try the lock takes over as leader.
+# Syncs are normally incremental, only looking at new releases, with a full reconciliation against the complete
+# list of releases done every so often to catch anything that slipped through. Alongside the syncs, the leader
+# keeps an eye on the queue of webhook notifications and processes any that come in. This is done on a thread of
+# its own so that webhook work doesn't have to wait for a sync to finish, and its requests can go ahead of the
+# sync's in the rate limiter.
+class ReleaseSync:
+	def __init__(
+		self, app: Flask, db: SQLAlchemy, gitHubAPI: GitHubAPI, lockPath: Path, interval: float,
+		reconcileInterval: float, webhookQueue: WebhookQueue, pollInterval: float, onChange: Callable[[], None]
+	) -> None:
+		self.app = app
+		self.db = db
+		self.gitHubAPI = gitHubAPI
+		self.lockPath = lockPath
+		self.interval = interval
+		self.reconcileInterval = reconcileInterval
+		self.lastSync: float | None = None
+		self.lastReconcile = monotonic()
+		self.webhookQueue = webhookQueue
+		self.pollInterval = pollInterval
+		# Called (in an app context) whenever a sync changes the release index
+		self.onChange = onChange
+		self.lockFile: TextIO | None = None
+		self.lockFileLock = Lock()
+
+	# Start the background job running - this does not block, nor do any network I/O
+	def start(self):
+		Thread(target = self.run, name = 'release-sync', daemon = True).start()
+		Thread(target = self.runWebhooks, name = 'webhook-queue', daemon = True).start()
+
+	# Check if we're the leader, trying to become it if we're not
+	def isLeader(self) -> bool:
+		with self.lockFileLock:
+			if self.lockFile is not None:
+				return True
+
+			# Try to take an exclusive lock on the lock file without waiting - if someone else has it, they're leader
+			lockFile = self.lockPath.open('a')
+			try:
+				fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except BlockingIOError:
+				lockFile.close()
+				return False
+			# We got it, so hang onto the file (and so the lock) for as long as we live
+			self.lockFile = lockFile
+			return True
+
+	def run(self):
+		while True:
+			if self.isLeader():
+				# Sync as soon as we become leader, then every interval after that
+				if self.lastSync is None or monotonic() - self.lastSync >= self.interval:
+					self.sync()
+					self.lastSync = monotonic()
+			sleep(self.pollInterval)
+
+	# Process the webhook queue whenever we're leader, keeping up with it while any sync is underway
+	def runWebhooks(self):
+		while True:
+			if self.isLeader():
+				try:
+					self.webhookQueue.drain()
+				except Exception:
+					self.app.logger.exception('Failed to process the webhook queue')
+			sleep(self.pollInterval)
+
+	# Run a single sync of the release index, dealing with any fallout of it changing
+	def sync(self):
+		# Work out if it's time for a full reconciliation
+		full = monotonic() - self.lastReconcile >= self.reconcileInterval
+		with self.app.app_context():
+			try:
+				if self.gitHubAPI.updateReleases(self.db, full = full):
+					self.onChange()
+				if full:
+					self.lastReconcile = monotonic()
+			# If we ran out of API budget, give up on this sync rather than sit on what's left of it waiting
+			# for more - the next one will pick up where this left off
+			except RateLimitExceeded as error:
+				self.db.session.rollback()
+				self.app.logger.warning(f'Deferring release sync: {error}')
+				self.gitHubAPI.saveRateLimit(self.db)
+			except Exception:
+				self.db.session.rollback()
+				self.app.logger.exception('Failed to sync releases with GitHub')
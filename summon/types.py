@@ -241,8 +241,10 @@ class UnicodePath(Concatenable, TypeEngine[Path]):
 
 	# Define how to convert a value from a result set back into a Path from a query
 	def result_processor(self, dialect: Dialect, coltype: object) -> type_api._ResultProcessorType[Path]:
-		def process(value: str) -> Path:
-			return Path(value)
+		def process(value: str | None) -> Path | None:
+			if value is not None:
+				return Path(value)
+			return None
 		return process
 
 	@property
@@ -274,8 +276,10 @@ def intEnumMapper(*, type: type[IntEnumT]):
 
 		# Define how to convert a value from a result set back into a value of the mapped enum type from a query
 		def result_processor(self, dialect: Dialect, coltype: object) -> type_api._ResultProcessorType[IntEnumT]:
-			def process(value: int) -> IntEnumT:
-				return type(value)
+			def process(value: int | None) -> IntEnumT | None:
+				if value is not None:
+					return type(value)
+				return None
 			return process
 
 		@property
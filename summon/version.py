@@ -0,0 +1,60 @@
+# SPDX-License-Identifier: BSD-3-Clause
+from typing import TypeAlias
+import re
+
+__all__ = (
+	'VersionKey',
+	'versionKey',
+	'canonicalVersion',
+	'versionOrder',
+)
+
+# A key that release versions sort in the order they were released by: the version numbers themselves, then
+# how far through the pre-release stages (alpha, beta, release candidate, final) the version is, then which of
+# those pre-releases it is, and finally anything left over that we didn't understand
+VersionKey: TypeAlias = tuple[tuple[int, ...], int, int, str]
+
+# Matches release versions of the form `v1.10.0`, `v2.0.0-rc1`, `1.8.0-beta` and so on
+versionPattern = re.compile(
+	r'v?(?P<numbers>\d+(?:\.\d+)*)(?:-(?P<stage>alpha|beta|rc)\.?(?P<preRelease>\d*))?(?P<rest>.*)'
+)
+# How each of the pre-release stages ranks against the others and against the final release
+stageRanks = {
+	'alpha': 0,
+	'beta': 1,
+	'rc': 2,
+	None: 3,
+}
+
+# Turn a release version (tag name) into a key that sorts semantically, rather than lexically (so v1.10.0 comes
+# after v1.9.0, and v2.0.0-rc1 comes before v2.0.0). Versions we can't make sense of sort before all the others
+def versionKey(version: str) -> VersionKey:
+	match = versionPattern.fullmatch(version)
+	if match is None:
+		return ((), -1, 0, version)
+	# Pad the version numbers out to at least major.minor.patch so v1.9 and v1.9.0 compare equal
+	numbers = tuple(int(number) for number in match['numbers'].split('.'))
+	numbers += (0,) * (3 - len(numbers))
+	preRelease = match['preRelease']
+	return (numbers, stageRanks[match['stage']], int(preRelease) if preRelease else 0, match['rest'])
+
+# Turn a release version given by a client into the one spelling of it that all the ways of writing that version
+# share (so v1.9, 1.9.0 and v1.9.0 all become v1.9.0), rejecting anything that isn't a version we understand
+def canonicalVersion(version: str) -> str:
+	numbers, stageRank, preRelease, rest = versionKey(version)
+	if len(numbers) == 0 or rest != '':
+		raise ValueError(f'Invalid version {version}')
+	canonical = f"v{'.'.join(str(number) for number in numbers)}"
+	for stage, rank in stageRanks.items():
+		if stage is not None and rank == stageRank:
+			canonical += f'-{stage}{preRelease}'
+	return canonical
+
+# Turn a release version into a string that sorts the same way as its version key does, for storing in the
+# database alongside the version so the database can do the sorting. Each number gets padded out to a fixed
+# width so they compare properly as strings, and versions we can't make sense of get marked to sort first
+def versionOrder(version: str) -> str:
+	numbers, stageRank, preRelease, rest = versionKey(version)
+	if len(numbers) == 0:
+		return f'!{version}'
+	return f"{'.'.join(f'{number:06d}' for number in numbers)}-{stageRank}{preRelease:06d}{rest}"
@@ -0,0 +1,185 @@
+# SPDX-License-Identifier: BSD-3-Clause
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import sql
+from sqlalchemy.exc import IntegrityError
+from collections.abc import Callable
+from time import time
+from uuid import uuid4
+import json
+
+from .github import GitHubAPI
+from .githubTypes import GitHubReleaseWebhook
+from .rateLimit import Priority, requestPriority
+from .models import WebhookJob
+
+__all__ = (
+	'WebhookQueue',
+)
+
+# How long in seconds a job is claimed for while it is being processed, after which it's assumed whoever was
+# processing it died and it becomes due again
+jobLease = 600
+# How long to wait before retrying a job the first time it fails, doubling with each failure after that
+retryDelay = 30
+# How many times to try a job before giving up on it (leaving it in the queue, marked failed, to be looked at)
+maxAttempts = 8
+# How long in seconds to wait for a burst of notifications about the same release to die down before processing
+# them, with each new notification about the release restarting the wait
+debounceWindow = 10
+# The longest in seconds a notification can be held back by more notifications about the same release arriving,
+# so a release being edited over and over doesn't keep its changes from showing up indefinitely
+maxDebounce = 60
+# How long in seconds to remember the deliveries of completed jobs for, so GitHub re-delivering them is spotted
+completedRetention = 3 * 24 * 60 * 60
+
+# Defines the queue of release webhook notifications waiting to be processed. The webhook handler adds jobs
+# to the queue and the leader's release sync (or the reindex script) drains it, indexing the releases the
+# notifications were about and then letting everything serving metadata know the release index changed
+class WebhookQueue:
+	def __init__(
+		self, app: Flask, db: SQLAlchemy, gitHubAPI: GitHubAPI, onChange: Callable[[set[str] | None], None]
+	) -> None:
+		self.app = app
+		self.db = db
+		self.gitHubAPI = gitHubAPI
+		# Called (in an app context) with the versions of the releases changed after draining the queue
+		self.onChange = onChange
+
+	# Add a notification to the queue, returning False if it's a re-delivery of one we've already got. The job
+	# gets held back for a little while, as does any other job waiting on the same release, so a burst of
+	# notifications about a release all get processed together once things have settled down - though never for
+	# more than maxDebounce past when the oldest of those jobs was received
+	def enqueue(self, deliveryID: str | None, webhookRequest: GitHubReleaseWebhook, payload: str) -> bool:
+		if deliveryID is not None and self.db.session.scalar(
+			sql.select(WebhookJob.id).where(WebhookJob.deliveryID == deliveryID)
+		) is not None:
+			return False
+
+		now = time()
+		dueAt = now + debounceWindow
+		releaseID = webhookRequest.get('release', {}).get('id')
+		if releaseID is not None:
+			waiting = sql.and_(
+				WebhookJob.releaseID == releaseID, sql.not_(WebhookJob.failed), WebhookJob.completedAt.is_(None),
+				WebhookJob.attempts == 0
+			)
+			oldestCreatedAt = self.db.session.scalar(sql.select(sql.func.min(WebhookJob.createdAt)).where(waiting))
+			if oldestCreatedAt is not None:
+				dueAt = min(dueAt, oldestCreatedAt + maxDebounce)
+			self.db.session.execute(
+				sql.update(WebhookJob)
+				.where(waiting, WebhookJob.dueAt < dueAt)
+				.values(dueAt = dueAt)
+				.execution_options(synchronize_session = False)
+			)
+		self.db.session.add(WebhookJob(deliveryID, releaseID, payload, now, dueAt))
+		try:
+			self.db.session.commit()
+		except IntegrityError:
+			# Someone else got the same delivery in between us checking for it and adding it
+			self.db.session.rollback()
+			return False
+		return True
+
+	# Process all the jobs in the queue which are due, returning how many were processed successfully
+	def drain(self) -> int:
+		processed = 0
+		versions: set[str] = set()
+		# Anything we ask of the API while processing these gets to go ahead of background syncs
+		priority = requestPriority.set(Priority.webhook)
+		try:
+			with self.app.app_context():
+				self.pruneCompletedJobs()
+				while True:
+					jobs = self.claimNextJobs()
+					if len(jobs) == 0:
+						break
+					try:
+						versions |= self.gitHubAPI.processReleaseJobs(
+							self.db, [json.loads(job.payload) for job in jobs]
+						)
+						# It went well, so the jobs are done with - but hang on to them to remember the deliveries
+						completedAt = time()
+						for job in jobs:
+							job.completedAt = completedAt
+						self.db.session.commit()
+						processed += len(jobs)
+					except Exception as error:
+						self.db.session.rollback()
+						self.app.logger.exception(f'Failed to process webhook jobs {[job.id for job in jobs]}')
+						for job in jobs:
+							self.retryLater(job, error)
+
+				# Now the queue is empty, let everything know what changed in one go
+				if len(versions) != 0:
+					self.onChange(versions)
+		finally:
+			requestPriority.reset(priority)
+		return processed
+
+	# Find the next job which is due and claim it by pushing its due time out by the lease and marking it with a
+	# token of our own, so nobody else draining the queue at the same time picks it up too. Any other jobs waiting
+	# on the same release which are nearly due get claimed along with it, returning them all in the order they
+	# were received
+	def claimNextJobs(self) -> list[WebhookJob]:
+		pending = sql.and_(sql.not_(WebhookJob.failed), WebhookJob.completedAt.is_(None))
+		claimToken = uuid4().hex
+		while True:
+			now = time()
+			job = self.db.session.scalar(
+				sql.select(WebhookJob)
+				.where(pending, WebhookJob.dueAt <= now)
+				.order_by(WebhookJob.dueAt, WebhookJob.id)
+				.limit(1)
+			)
+			if job is None:
+				return []
+			# If someone else claimed the job (or it got held back again) between us finding it and trying to
+			# claim it, it will no longer be due, so look for another
+			leaseUntil = now + jobLease
+			claimed = self.db.session.execute(
+				sql.update(WebhookJob)
+				.where(WebhookJob.id == job.id, pending, WebhookJob.dueAt <= now)
+				.values(dueAt = leaseUntil, claimToken = claimToken)
+				.execution_options(synchronize_session = False)
+			)
+			self.db.session.commit()
+			if claimed.rowcount != 1:
+				continue
+			if job.releaseID is not None:
+				self.db.session.execute(
+					sql.update(WebhookJob)
+					.where(
+						pending, WebhookJob.releaseID == job.releaseID, WebhookJob.id != job.id,
+						WebhookJob.dueAt <= now + debounceWindow
+					)
+					.values(dueAt = leaseUntil, claimToken = claimToken)
+					.execution_options(synchronize_session = False)
+				)
+				self.db.session.commit()
+			# Now pick up everything we managed to claim
+			return list(self.db.session.scalars(
+				sql.select(WebhookJob)
+				.where(pending, WebhookJob.claimToken == claimToken)
+				.order_by(WebhookJob.id)
+			))
+
+	# Throw away completed jobs once they're old enough that GitHub won't be re-delivering them
+	def pruneCompletedJobs(self):
+		self.db.session.execute(
+			sql.delete(WebhookJob)
+			.where(WebhookJob.completedAt < time() - completedRetention)
+			.execution_options(synchronize_session = False)
+		)
+		self.db.session.commit()
+
+	# Note that a job failed, scheduling it to be tried again after a while unless it's failed too many times
+	def retryLater(self, job: WebhookJob, error: Exception):
+		job.attempts += 1
+		job.lastError = repr(error)
+		if job.attempts >= maxAttempts:
+			job.failed = True
+		else:
+			job.dueAt = time() + retryDelay * 2 ** (job.attempts - 1)
+		self.db.session.commit()
@@ -0,0 +1,40 @@
+# SPDX-License-Identifier: BSD-3-Clause
+from pathlib import Path
+from tempfile import mkdtemp
+import os
+import pytest
+
+# summon configures itself on import, so point it at a configuration for the tests before anything imports it
+testPath = Path(mkdtemp(prefix = 'summon-tests-'))
+(testPath / 'config.py').write_text(
+	"SECRET_KEY = 'test'\n"
+	f"SQLALCHEMY_DATABASE_URI = 'sqlite:///{testPath / 'summon.db'}'\n"
+	'GITHUB_API_TOKEN = None\n'
+	"GITHUB_SECRET = 'test'\n"
+	f"ETAG_CACHE_PATH = '{testPath / 'etag-cache.sqlite'}'\n"
+	f"RELEASE_SYNC_LOCK_PATH = '{testPath / 'release-sync.lock'}'\n"
+	f"MIGRATION_LOCK_PATH = '{testPath / 'migration.lock'}'\n"
+)
+os.environ['SUMMON_CONFIG'] = str(testPath / 'config.py')
+
+# Give each test an app context with an empty database to work in
+@pytest.fixture
+def app():
+	from summon import app, db
+	with app.app_context():
+		db.drop_all()
+		db.create_all()
+		yield app
+		db.session.remove()
+
+@pytest.fixture
+def db(app):
+	from summon import db
+	return db
+
+# Give each test a client to make requests of summon with, having made sure nothing cached by earlier tests is served
+@pytest.fixture
+def client(app):
+	from summon import invalidateReleases
+	invalidateReleases()
+	return app.test_client()
@@ -0,0 +1,76 @@
+# SPDX-License-Identifier: BSD-3-Clause
+from collections.abc import Iterator
+import json
+
+from summon.github import GitHubAPI, releasesPageURI, releasesPerPage
+
+# Stands in for a response from the GitHub API
+class FakeResponse:
+	def __init__(self, statusCode: int, content: bytes = b'', headers: dict[str, str] | None = None,
+		links: dict[str, dict[str, str]] | None = None) -> None:
+		self.status_code = statusCode
+		self.content = content
+		self.headers = headers if headers is not None else {}
+		self.links = links if links is not None else {}
+		self.closed = False
+
+	@property
+	def ok(self) -> bool:
+		return self.status_code < 400
+
+	def raise_for_status(self):
+		if self.status_code >= 400:
+			raise RuntimeError(f'HTTP error {self.status_code}')
+
+	def iter_content(self, chunk_size: int) -> Iterator[bytes]:
+		for offset in range(0, len(self.content), chunk_size):
+			yield self.content[offset:offset + chunk_size]
+
+	def close(self):
+		self.closed = True
+
+	def __enter__(self) -> 'FakeResponse':
+		return self
+
+	def __exit__(self, *exception):
+		self.close()
+
+# Stands in for GitHub serving the list of releases for the BMD repo, newest first, in pages
+class FakeGitHub:
+	def __init__(self) -> None:
+		self.releases: list[dict] = []
+		self.responses: list[FakeResponse] = []
+
+	def get(self, uri: str, headers: dict[str, str] | None = None, **kwargs) -> FakeResponse:
+		page = int(uri.rpartition('page=')[2])
+		pageCount = max((len(self.releases) + releasesPerPage - 1) // releasesPerPage, 1)
+		links = {'last': {'url': releasesPageURI(pageCount)}}
+		if page < pageCount:
+			links['next'] = {'url': releasesPageURI(page + 1)}
+		releases = self.releases[(page - 1) * releasesPerPage:page * releasesPerPage]
+		etag = f'"{hash(json.dumps(releases))}"'
+		# Answer conditional requests for pages that haven't changed as GitHub would
+		if headers is not None and headers.get('If-None-Match') == etag:
+			response = FakeResponse(304, headers = {'ETag': etag}, links = links)
+		else:
+			response = FakeResponse(200, json.dumps(releases).encode(), {'ETag': etag}, links)
+		self.responses.append(response)
+		return response
+
+	# Make an instance of the API bindings that talks to this rather than GitHub
+	def api(self) -> GitHubAPI:
+		api = GitHubAPI(None)
+		api.session = self
+		return api
+
+# Make up the listing entry for a release with no assets, much as GitHub would
+def releaseListing(releaseID: int, version: str, publishedAt: str | None) -> dict:
+	return {
+		'id': releaseID,
+		'tag_name': version,
+		'draft': publishedAt is None,
+		'published_at': publishedAt,
+		'body': 'Release notes',
+		'author': {'login': 'someone'},
+		'assets': [],
+	}
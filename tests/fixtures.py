@@ -0,0 +1,49 @@
+# SPDX-License-Identifier: BSD-3-Clause
+from contextlib import contextmanager
+from sqlalchemy import event
+from pathlib import Path
+
+from summon.models import Release, ReleaseProbe, FirmwareDownload, BMDABinary
+from summon.types import Probe, TargetOS, TargetArch
+
+# The platforms BMDA gets built for in the releases made up for the tests
+bmdaPlatforms = (
+	(TargetOS.linux, TargetArch.amd64),
+	(TargetOS.windows, TargetArch.i386),
+	(TargetOS.macOS, TargetArch.aarch64),
+)
+
+# Fill the database with a number of made up releases (v1.<first>.0 on), each having a few probes with a couple of
+# firmware variants each, and BMDA for a few platforms
+def addReleases(
+	db, count: int, first: int = 0, probes: tuple[Probe, ...] = (Probe.native, Probe.stlink, Probe.f3)
+):
+	for index in range(first, first + count):
+		version = f'v1.{index}.0'
+		release = Release(version)
+		for probe in probes:
+			releaseProbe = ReleaseProbe(release, probe)
+			for variantName in ('common', 'riscv'):
+				firmware = FirmwareDownload(releaseProbe)
+				firmware.variantName = variantName
+				firmware.friendlyName = f'Black Magic Debug for {probe.toString()} ({variantName})'
+				firmware.fileName = Path(f'blackmagic-{probe.toString()}-{variantName}-{version}.elf')
+				firmware.uri = f'https://example.com/{version}/{probe.toString()}-{variantName}.elf'
+		for targetOS, targetArch in bmdaPlatforms:
+			binary = BMDABinary(release, targetOS, targetArch)
+			binary.fileName = Path('blackmagic')
+			binary.uri = f'https://example.com/{version}/bmda-{targetOS.toString()}.zip'
+		db.session.add(release)
+	db.session.commit()
+
+# Count the SQL statements run against the database while inside the block
+@contextmanager
+def countStatements(db):
+	statements = []
+	def recordStatement(connection, cursor, statement, parameters, context, executemany):
+		statements.append(statement)
+	event.listen(db.engine, 'before_cursor_execute', recordStatement)
+	try:
+		yield statements
+	finally:
+		event.remove(db.engine, 'before_cursor_execute', recordStatement)
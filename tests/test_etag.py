@@ -0,0 +1,237 @@
+# SPDX-License-Identifier: BSD-3-Clause
+from flask import Flask, Response
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+from urllib.parse import urlencode
+import gzip
+import pytest
+
+from summon import etag
+from summon.etag import ETagCache, SharedETagStore
+
+# How to undo each of the encodings responses can be precompressed with
+decoders = {'gzip': gzip.decompress}
+if etag.brotli is not None:
+	decoders['br'] = etag.brotli.decompress
+if etag.zstandard is not None:
+	decoders['zstd'] = lambda data: etag.zstandard.ZstdDecompressor().decompress(data)
+
+@pytest.fixture
+def cacheApp():
+	return Flask(__name__)
+
+# A worker that claimed an entry's rebuild and then died must not hold up everyone else for the whole lease
+def testRebuildTakesOverFromDeadWorker(tmp_path, monkeypatch):
+	monkeypatch.setattr(etag, 'maxRebuildWait', 0.2)
+	storePath = tmp_path / 'etag-cache.sqlite'
+	cache = ETagCache(storePath)
+	def handler():
+		return {}
+	cache.json(handler)
+	# Another worker claims the rebuild, but never finishes it
+	assert SharedETagStore(storePath).claim('handler', 0, etag.rebuildLease)
+
+	start = monotonic()
+	cache.rebuild(handler, 'handler', lambda: Response(b'{}'))
+	assert monotonic() - start < 5
+	assert cache.lookupResponse('handler') is not None
+
+def testCacheControlAllowsStaleWhileRevalidate(cacheApp):
+	cache = ETagCache()
+	@cacheApp.route('/thing.json')
+	@cache.json
+	def thing():
+		return {'thing': 1}
+
+	response = cacheApp.test_client().get('/thing.json')
+	assert response.status_code == 200
+	cacheControl = {directive.strip() for directive in response.headers['Cache-Control'].split(',')}
+	assert f'stale-while-revalidate={etag.staleWhileRevalidate}' in cacheControl
+	assert 'no-cache' not in cacheControl
+
+# An entry that gets dropped to make room for another right after being built must still get served
+def testServesEntryEvictedAfterRebuild(cacheApp, monkeypatch):
+	cache = ETagCache()
+	@cacheApp.route('/thing.json')
+	@cache.json
+	def thing():
+		return {'thing': 1}
+
+	# Have another request's entry push this one straight back out of the cache as soon as it's built
+	etagResponse = cache.etag
+	def etagThenEvict(key, *args):
+		entry = etagResponse(key, *args)
+		cache.discard(key)
+		return entry
+	monkeypatch.setattr(cache, 'etag', etagThenEvict)
+
+	response = cacheApp.test_client().get('/thing.json')
+	assert response.status_code == 200
+	assert response.json == {'thing': 1}
+
+# Serving an entry from the cache marks it used, so it's entries nobody has asked for in a while that get dropped
+def testEvictsLeastRecentlyUsed(cacheApp, monkeypatch):
+	cache = ETagCache()
+	@cacheApp.route('/thing.json')
+	@cache.json
+	def thing(n: str):
+		return {'n': n}
+
+	client = cacheApp.test_client()
+	assert client.get('/thing.json?n=hot').status_code == 200
+	# Make room for only two entries the size of that one
+	monkeypatch.setattr(etag, 'maxCachedBytes', cache.cachedBytes * 2)
+	for n in ('a', 'hot', 'b'):
+		assert client.get(f'/thing.json?n={n}').status_code == 200
+	assert list(cache.entries) == ['thing?n=hot', 'thing?n=b']
+
+# Rebuilding one entry must not hold up rebuilding another
+def testRebuildsOfDifferentEntriesRunTogether(cacheApp):
+	cache = ETagCache()
+	@cacheApp.route('/thing.json')
+	@cache.json
+	def thing(n: str):
+		sleep(0.5)
+		return {'n': n}
+
+	def get(n: int) -> int:
+		return cacheApp.test_client().get(f'/thing.json?n={n}').status_code
+
+	start = monotonic()
+	with ThreadPoolExecutor(max_workers = 4) as executor:
+		assert list(executor.map(get, range(4))) == [200] * 4
+	assert monotonic() - start < 1.5
+	assert cache.rebuildLocks == {}
+
+@pytest.fixture
+def thingClient(cacheApp):
+	cache = ETagCache()
+	@cacheApp.route('/thing.json')
+	@cache.json
+	def thing():
+		return {'thing': 'x' * 1024}
+	return cacheApp.test_client()
+
+# Each precompressed encoding the client accepts must come back with its own strong ETag and decompress to the
+# same content as the uncompressed response
+@pytest.mark.parametrize('encoding', etag.encoders.keys())
+def testNegotiatesEncoding(thingClient, encoding):
+	identity = thingClient.get('/thing.json')
+	assert 'Content-Encoding' not in identity.headers
+	assert identity.headers['Vary'] == 'Accept-Encoding'
+	digest = identity.headers['ETag'].strip('"')
+
+	response = thingClient.get('/thing.json', headers = {'Accept-Encoding': encoding})
+	assert response.status_code == 200
+	assert response.headers['Content-Encoding'] == encoding
+	assert response.headers['Vary'] == 'Accept-Encoding'
+	assert response.headers['ETag'] == f'"{digest}-{encoding}"'
+	assert decoders[encoding](response.data) == identity.data
+
+@pytest.mark.parametrize(('acceptEncoding', 'encoding'), (
+	('', 'identity'),
+	('gzip', 'gzip'),
+	('gzip;q=0', 'identity'),
+	('identity;q=0.5, gzip', 'gzip'),
+	('compress', 'identity'),
+	('*', etag.encodings[0]),
+))
+def testEncodingPreference(thingClient, acceptEncoding, encoding):
+	response = thingClient.get('/thing.json', headers = {'Accept-Encoding': acceptEncoding})
+	assert response.headers.get('Content-Encoding', 'identity') == encoding
+
+# A client revalidating gets a 304 only if its ETag is the one for the encoding it would be sent now
+def testNotModifiedPerEncoding(thingClient):
+	gzipETag = thingClient.get('/thing.json', headers = {'Accept-Encoding': 'gzip'}).headers['ETag']
+	identityETag = thingClient.get('/thing.json').headers['ETag']
+
+	response = thingClient.get('/thing.json', headers = {'Accept-Encoding': 'gzip', 'If-None-Match': gzipETag})
+	assert response.status_code == 304
+	assert response.headers['ETag'] == gzipETag
+	assert response.headers['Vary'] == 'Accept-Encoding'
+	# Proxies that recompress weaken the ETag, which still counts as a match
+	response = thingClient.get('/thing.json', headers = {'Accept-Encoding': 'gzip', 'If-None-Match': f'W/{gzipETag}'})
+	assert response.status_code == 304
+	assert thingClient.get('/thing.json', headers = {'If-None-Match': identityETag}).status_code == 304
+
+	# The ETag of one encoding doesn't match the representation in another
+	response = thingClient.get('/thing.json', headers = {'If-None-Match': gzipETag})
+	assert response.status_code == 200
+	assert response.headers['ETag'] == identityETag
+	response = thingClient.get('/thing.json', headers = {'Accept-Encoding': 'gzip', 'If-None-Match': identityETag})
+	assert response.status_code == 200
+	assert response.headers['ETag'] == gzipETag
+
+# Stands in for a worker process serving a handler out of its own cache, sharing the store with the others
+class Worker:
+	def __init__(self, storePath, content: dict[str, str]) -> None:
+		self.app = Flask(__name__)
+		self.cache = ETagCache(storePath)
+		self.builds = 0
+		@self.app.route('/releases/<version>.json')
+		@self.cache.json
+		def release(version: str):
+			self.builds += 1
+			return {'version': version, 'content': content[version]}
+		self.client = self.app.test_client()
+
+	def get(self, version: str) -> dict:
+		response = self.client.get(f'/releases/{version}.json')
+		assert response.status_code == 200
+		return response.json
+
+	# Wait for any rebuilds going on in the background to finish
+	def settle(self):
+		giveUpAt = monotonic() + 5
+		while len(self.cache.pendingRebuilds) != 0 and monotonic() < giveUpAt:
+			sleep(0.01)
+
+def testWorkersShareEntries(tmp_path):
+	content = {'v1.0.0': 'old', 'v2.0.0': 'old'}
+	first = Worker(tmp_path / 'etag-cache.sqlite', content)
+	second = Worker(tmp_path / 'etag-cache.sqlite', content)
+	assert first.get('v1.0.0')['content'] == 'old'
+	# The second worker picks up what the first built rather than building it again
+	assert second.get('v1.0.0')['content'] == 'old'
+	assert second.builds == 0
+	assert second.cache.hits['release'] == 1
+
+def testInvalidationReachesOtherWorkers(tmp_path):
+	content = {'v1.0.0': 'old', 'v2.0.0': 'old'}
+	first = Worker(tmp_path / 'etag-cache.sqlite', content)
+	second = Worker(tmp_path / 'etag-cache.sqlite', content)
+	for version in content:
+		first.get(version)
+		second.get(version)
+
+	# One worker invalidates just the one release's entries
+	content['v1.0.0'] = content['v2.0.0'] = 'new'
+	first.cache.invalidate(handlerName = 'release', prefix = urlencode({'version': 'v1.0.0'}))
+	# The other keeps serving what it has while it rebuilds the invalidated entry, then serves the new one
+	assert second.get('v1.0.0')['content'] == 'old'
+	assert second.cache.staleHits['release'] == 1
+	second.settle()
+	assert second.get('v1.0.0')['content'] == 'new'
+	# Having been rebuilt by the second worker, the first picks that up rather than rebuilding it too
+	builds = first.builds
+	assert first.get('v1.0.0')['content'] == 'new'
+	assert first.builds == builds
+	# Entries for other releases are untouched by the invalidation, so stay as they were
+	assert second.get('v2.0.0')['content'] == 'old'
+	assert first.get('v2.0.0')['content'] == 'old'
+
+# Once a worker's entry is older than the invalidations the store remembers, it must be treated as invalidated as
+# there's no knowing if any of the forgotten ones were for it
+def testForgottenInvalidationsInvalidate(tmp_path, monkeypatch):
+	monkeypatch.setattr(etag, 'maxInvalidations', 4)
+	content = {'v1.0.0': 'old', 'v2.0.0': 'old'}
+	first = Worker(tmp_path / 'etag-cache.sqlite', content)
+	second = Worker(tmp_path / 'etag-cache.sqlite', content)
+	second.get('v2.0.0')
+
+	content['v2.0.0'] = 'new'
+	for _ in range(8):
+		first.cache.invalidate(handlerName = 'release', prefix = urlencode({'version': 'v1.0.0'}))
+	assert second.get('v2.0.0')['content'] == 'old'
+	second.settle()
+	assert second.get('v2.0.0')['content'] == 'new'
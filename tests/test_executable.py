@@ -0,0 +1,108 @@
+# SPDX-License-Identifier: BSD-3-Clause
+from struct import pack
+import pytest
+
+from summon.executable import executableArch
+from summon.types import TargetArch
+
+# Build the start of an ELF file of a given class (1 for 32-bit, 2 for 64-bit), byte order and machine
+def elfHeader(elfClass: int, littleEndian: bool, machine: int) -> bytes:
+	byteOrder = '<' if littleEndian else '>'
+	identity = b'\x7fELF' + bytes((elfClass, 1 if littleEndian else 2, 1)) + bytes(9)
+	return identity + pack(f'{byteOrder}HHI', 2, machine, 1) + bytes(40)
+
+# Build the start of a PE file, with the PE header a little way in after the DOS stub
+def peHeader(machine: int, peOffset: int = 0x80) -> bytes:
+	dosHeader = b'MZ' + bytes(0x3a) + pack('<I', peOffset)
+	return dosHeader.ljust(peOffset, b'\0') + b'PE\0\0' + pack('<HH', machine, 1) + bytes(16)
+
+# Build the start of a thin Mach-O file of a given word size and byte order for a CPU type
+def machOHeader(is64: bool, littleEndian: bool, cpuType: int) -> bytes:
+	byteOrder = '<' if littleEndian else '>'
+	return pack(f'{byteOrder}Iii', 0xfeedfacf if is64 else 0xfeedface, cpuType, 3) + bytes(20)
+
+# Build the start of a fat Mach-O file containing the given CPU types, with 32- or 64-bit offsets
+def fatHeader(cpuTypes: list[int], is64: bool = False) -> bytes:
+	header = pack('>II', 0xcafebabf if is64 else 0xcafebabe, len(cpuTypes))
+	for cpuType in cpuTypes:
+		if is64:
+			header += pack('>iiQQII', cpuType, 0, 0x4000, 0x1000, 14, 0)
+		else:
+			header += pack('>iiIII', cpuType, 0, 0x4000, 0x1000, 14)
+	return header
+
+cpuTypeX86 = 7
+cpuTypeX86_64 = 0x01000007
+cpuTypeARM = 12
+cpuTypeARM64 = 0x0100000c
+
+@pytest.mark.parametrize(('header', 'arch'), (
+	(elfHeader(1, True, 3), TargetArch.i386),
+	(elfHeader(2, True, 62), TargetArch.amd64),
+	(elfHeader(1, True, 40), TargetArch.aarch32),
+	(elfHeader(2, True, 183), TargetArch.aarch64),
+	(elfHeader(1, False, 40), TargetArch.aarch32),
+	(elfHeader(2, False, 183), TargetArch.aarch64),
+	(elfHeader(2, True, 243), None), # RISC-V
+))
+def testELF(header, arch):
+	assert executableArch(header) == arch
+
+@pytest.mark.parametrize(('header', 'arch'), (
+	(peHeader(0x014c), TargetArch.i386),
+	(peHeader(0x8664), TargetArch.amd64),
+	(peHeader(0x01c4), TargetArch.aarch32),
+	(peHeader(0xaa64), TargetArch.aarch64),
+	(peHeader(0x8664, peOffset = 0x200), TargetArch.amd64),
+	(peHeader(0x0200), None), # Itanium
+))
+def testPE(header, arch):
+	assert executableArch(header) == arch
+
+# A DOS executable has no PE header where the DOS header says it is
+def testDOSExecutable():
+	header = bytearray(peHeader(0x8664))
+	header[0x80:0x84] = b'NE\0\0'
+	assert executableArch(bytes(header)) is None
+
+@pytest.mark.parametrize('littleEndian', (True, False))
+@pytest.mark.parametrize(('is64', 'cpuType', 'arch'), (
+	(False, cpuTypeX86, TargetArch.i386),
+	(True, cpuTypeX86_64, TargetArch.amd64),
+	(False, cpuTypeARM, TargetArch.aarch32),
+	(True, cpuTypeARM64, TargetArch.aarch64),
+))
+def testMachO(is64, cpuType, arch, littleEndian):
+	assert executableArch(machOHeader(is64, littleEndian, cpuType)) == arch
+
+@pytest.mark.parametrize('is64', (False, True))
+@pytest.mark.parametrize(('cpuTypes', 'arch'), (
+	([cpuTypeARM64], TargetArch.aarch64),
+	([cpuTypeARM64, cpuTypeX86_64], TargetArch.amd64),
+	([cpuTypeX86, cpuTypeARM], TargetArch.i386),
+	([18], None), # PowerPC
+))
+def testFatMachO(cpuTypes, arch, is64):
+	assert executableArch(fatHeader(cpuTypes, is64)) == arch
+
+# Java class files share the fat binary magic, followed by their version rather than a count of architectures
+def testJavaClassFile():
+	assert executableArch(pack('>IHH', 0xcafebabe, 0, 61) + bytes(32)) is None
+
+@pytest.mark.parametrize(('header', 'needed'), (
+	(elfHeader(2, True, 62), 20),
+	(peHeader(0x8664), 0x86),
+	(machOHeader(True, True, cpuTypeX86_64), 8),
+	(fatHeader([cpuTypeARM64, cpuTypeX86_64]), 8 + 20 + 4),
+))
+def testTruncated(header, needed):
+	# Cut off anywhere before the part that says what the architecture is, there's no telling what it is (and
+	# certainly no raising), and from there on we must always get the right answer
+	arch = executableArch(header)
+	assert arch is not None
+	for length in range(len(header)):
+		assert executableArch(header[:length]) == (arch if length >= needed else None), length
+
+@pytest.mark.parametrize('header', (b'', b'#!/bin/sh\n', b'PK\x03\x04', bytes(64)))
+def testNotExecutable(header):
+	assert executableArch(header) is None
@@ -0,0 +1,61 @@
+# SPDX-License-Identifier: BSD-3-Clause
+from json import JSONDecodeError
+import json
+import pytest
+
+from summon.jsonStream import iterJSONArray
+
+document = [
+	{'id': 12345, 'name': 'blackmagic-native-v1.10.0.elf', 'size': 1.5e3},
+	'Ünïcödé 🙃',
+	[],
+	-67890,
+	None,
+	True,
+	{'nested': [1, [2, {'deep': '"quoted"'}]]},
+]
+encoded = json.dumps(document, ensure_ascii = False, indent = '\t').encode()
+
+def inChunks(data: bytes, size: int) -> list[bytes]:
+	return [data[offset:offset + size] for offset in range(0, len(data), size)]
+
+# However the data gets split up, including down to a byte at a time (so splitting numbers, escapes and multibyte
+# UTF-8 sequences), the same elements have to come out
+@pytest.mark.parametrize('chunkSize', (1, 2, 3, 7, 64, len(encoded)))
+def testChunkSizes(chunkSize):
+	assert list(iterJSONArray(inChunks(encoded, chunkSize))) == document
+
+def testEverySplitPoint():
+	for split in range(len(encoded) + 1):
+		assert list(iterJSONArray([encoded[:split], encoded[split:]])) == document, split
+
+# A number cut short by the end of a chunk must not come out as the part of it that arrived first
+def testSplitNumber():
+	assert list(iterJSONArray([b'[123', b'45, 6', b'7]'])) == [12345, 67]
+
+def testEmptyChunks():
+	assert list(iterJSONArray([b'', b' [', b'', b'1', b'', b']', b''])) == [1]
+
+@pytest.mark.parametrize('data', (b'[]', b' \n[ \t]\n', b'[\n]'))
+def testEmptyArray(data):
+	assert list(iterJSONArray(inChunks(data, 1))) == []
+
+# Elements are handed out as they arrive, before the rest of the array has
+def testYieldsBeforeEnd():
+	def chunks():
+		yield b'[{"id": 1},'
+		raise AssertionError('Read past the first element')
+	assert next(iterJSONArray(chunks())) == {'id': 1}
+
+@pytest.mark.parametrize('data', (
+	b'',
+	b'{"id": 1}',
+	b'[1, 2',
+	b'[1 2]',
+	b'[1,',
+	b'[{"id": }]',
+	b'["unterminated]',
+))
+def testMalformed(data):
+	with pytest.raises(JSONDecodeError):
+		list(iterJSONArray(inChunks(data, 3)))
@@ -0,0 +1,36 @@
+# SPDX-License-Identifier: BSD-3-Clause
+from summon.metadata import metadataToJSON
+from summon.types import Probe, TargetOS
+
+from .fixtures import addReleases, countStatements
+
+def metadataStatementCount(db, **filters) -> int:
+	db.session.expire_all()
+	with countStatements(db) as statements:
+		metadataToJSON(db, **filters)
+	return len(statements)
+
+# Building the metadata must take the same (small) number of queries no matter how many releases there are
+def testStatementCountFixed(db):
+	addReleases(db, 2)
+	fewReleases = metadataStatementCount(db)
+	addReleases(db, 20, first = 2)
+	manyReleases = metadataStatementCount(db)
+	assert fewReleases == manyReleases
+	assert manyReleases <= 2
+
+def testFilteredStatementCountFixed(db):
+	addReleases(db, 2)
+	fewReleases = metadataStatementCount(db, probe = Probe.native, targetOS = TargetOS.linux, latest = 1)
+	addReleases(db, 20, first = 2)
+	manyReleases = metadataStatementCount(db, probe = Probe.native, targetOS = TargetOS.linux, latest = 1)
+	assert fewReleases == manyReleases
+
+def testMetadataContents(db):
+	addReleases(db, 2)
+	releases = metadataToJSON(db)['releases']
+	assert list(releases) == ['v1.1.0', 'v1.0.0']
+	release = releases['v1.1.0']
+	assert release['includesBMDA']
+	assert set(release['firmware']['native']) == {'common', 'riscv'}
+	assert release['bmda']['linux']['amd64']['uri'] == 'https://example.com/v1.1.0/bmda-linux.zip'
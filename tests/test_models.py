@@ -0,0 +1,137 @@
+# SPDX-License-Identifier: BSD-3-Clause
+from sqlalchemy import inspect, sql
+import os
+import sqlite3
+import subprocess
+import sys
+import pytest
+
+from summon.models import Release, ReleaseProbe, FirmwareDownload, BMDABinary, migrateSchema
+from summon.types import Probe, TargetOS, TargetArch
+
+from .fixtures import addReleases
+
+# Get the plan SQLite comes up with for a query, as the lines of EXPLAIN QUERY PLAN
+def queryPlan(db, query) -> list[str]:
+	compiled = query.compile(db.engine)
+	parameters = tuple(compiled.params[name] for name in compiled.positiontup)
+	with db.engine.connect() as connection:
+		rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', parameters).all()
+	return [row[-1] for row in rows]
+
+@pytest.mark.parametrize(('query', 'index'), (
+	(
+		sql.select(Release).where(Release.version == 'v1.5.0'),
+		'ix_release_version',
+	),
+	(
+		sql.select(ReleaseProbe).where(ReleaseProbe.releaseID == 1, ReleaseProbe.probe == Probe.native.value),
+		'ix_release_probe_releaseID_probe',
+	),
+	(
+		sql.select(FirmwareDownload).where(FirmwareDownload.releaseFirmwareID == 1),
+		'ix_firmware_download_releaseFirmwareID',
+	),
+	(
+		sql.select(BMDABinary).where(
+			BMDABinary.releaseID == 1, BMDABinary.targetOS == TargetOS.linux.value,
+			BMDABinary.targetArch == TargetArch.amd64.value
+		),
+		'ix_bmda_binary_releaseID_targetOS_targetArch',
+	),
+	# Walking from a release to its probes, and on to their firmware, as building the metadata does
+	(
+		sql.select(FirmwareDownload.uri)
+		.join(ReleaseProbe, FirmwareDownload.releaseFirmwareID == ReleaseProbe.id)
+		.where(ReleaseProbe.releaseID == 1),
+		'ix_firmware_download_releaseFirmwareID',
+	),
+	(
+		sql.select(ReleaseProbe.id).where(ReleaseProbe.releaseID == 1),
+		'ix_release_probe_releaseID_probe',
+	),
+	(
+		sql.select(BMDABinary.uri).where(BMDABinary.releaseID == 1),
+		'ix_bmda_binary_releaseID_targetOS_targetArch',
+	),
+))
+def testLookupsUseIndexes(db, query, index):
+	addReleases(db, 10)
+	with db.engine.connect() as connection:
+		connection.exec_driver_sql('ANALYZE')
+	plan = queryPlan(db, query)
+	assert any(f'INDEX {index} ' in step for step in plan), plan
+
+# Duplicates left over from before there were unique indexes must get cleaned up rather than stop the indexes
+# (and so summon) from being made
+def testMigrationRemovesDuplicates(db):
+	addReleases(db, 2)
+	with db.engine.begin() as connection:
+		connection.exec_driver_sql('DROP INDEX ix_release_version')
+		connection.exec_driver_sql('DROP INDEX ix_release_probe_releaseID_probe')
+	# Make a second copy of a release, and a second copy of a probe in another release
+	with db.engine.begin() as connection:
+		duplicateID = connection.execute(
+			sql.insert(Release).values(version = 'v1.0.0', versionOrder = '').returning(Release.id)
+		).scalar_one()
+		connection.execute(sql.insert(ReleaseProbe).values(releaseID = duplicateID, probe = Probe.native))
+		connection.execute(sql.insert(BMDABinary).values(
+			releaseID = duplicateID, targetOS = TargetOS.linux, targetArch = TargetArch.amd64,
+			fileName = 'blackmagic', uri = 'https://example.com/duplicate.zip'
+		))
+		releaseID = connection.scalar(sql.select(Release.id).where(Release.version == 'v1.1.0'))
+		duplicateProbeID = connection.execute(
+			sql.insert(ReleaseProbe).values(releaseID = releaseID, probe = Probe.native).returning(ReleaseProbe.id)
+		).scalar_one()
+		connection.execute(sql.insert(FirmwareDownload).values(
+			releaseFirmwareID = duplicateProbeID, variantName = 'common', friendlyName = 'duplicate',
+			fileName = 'duplicate.elf', uri = 'https://example.com/duplicate.elf'
+		))
+
+	migrateSchema(db)
+	db.session.expire_all()
+	assert db.session.scalar(sql.select(sql.func.count()).where(Release.version == 'v1.0.0')) == 1
+	assert db.session.get(Release, duplicateID) is None
+	assert db.session.get(ReleaseProbe, duplicateProbeID) is None
+	assert db.session.scalar(sql.select(sql.func.count()).where(FirmwareDownload.friendlyName == 'duplicate')) == 0
+	assert db.session.scalar(
+		sql.select(sql.func.count()).where(BMDABinary.uri == 'https://example.com/duplicate.zip')
+	) == 0
+	# And the unique indexes are now in place
+	inspector = inspect(db.engine)
+	assert {index['name']: index['unique'] for index in inspector.get_indexes('release')}['ix_release_version']
+	assert {
+		index['name']: index['unique'] for index in inspector.get_indexes('release_probe')
+	}['ix_release_probe_releaseID_probe']
+
+# Every worker migrates the database as it comes up, so several starting at once against an older database must
+# not trip over each other making the same changes to it
+def testWorkersStartingTogetherMigrateOnce(tmp_path):
+	databasePath = tmp_path / 'summon.db'
+	with sqlite3.connect(databasePath) as connection:
+		connection.execute('CREATE TABLE release (id INTEGER PRIMARY KEY, version VARCHAR NOT NULL)')
+		connection.execute("INSERT INTO release (version) VALUES ('v1.9.0')")
+	connection.close()
+	configPath = tmp_path / 'config.py'
+	configPath.write_text(
+		"SECRET_KEY = 'test'\n"
+		f"SQLALCHEMY_DATABASE_URI = 'sqlite:///{databasePath}'\n"
+		'GITHUB_API_TOKEN = None\n'
+		"GITHUB_SECRET = 'test'\n"
+		f"ETAG_CACHE_PATH = '{tmp_path / 'etag-cache.sqlite'}'\n"
+		f"MIGRATION_LOCK_PATH = '{tmp_path / 'migration.lock'}'\n"
+	)
+
+	environment = {**os.environ, 'SUMMON_CONFIG': str(configPath)}
+	workers = [
+		subprocess.Popen([sys.executable, '-c', 'import summon'], env = environment, stderr = subprocess.PIPE)
+		for _ in range(4)
+	]
+	for worker in workers:
+		_, errors = worker.communicate(timeout = 60)
+		assert worker.returncode == 0, errors.decode()
+	with sqlite3.connect(databasePath) as connection:
+		assert connection.execute('SELECT version, versionOrder FROM release').fetchall() == [
+			('v1.9.0', '000001.000009.000000-3000000')
+		]
+	connection.close()
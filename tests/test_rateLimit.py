@@ -0,0 +1,81 @@
+# SPDX-License-Identifier: BSD-3-Clause
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier, Event
+from time import time
+import pytest
+
+from summon.rateLimit import Priority, RateLimiter, RateLimitExceeded, requestPriority, withRequestPriority
+from summon.sync import ReleaseSync
+
+# Put the limiter in the state GitHub having told it how much of the budget is left would
+def limiterWithBudget(remaining: int, limit: int = 5000) -> RateLimiter:
+	limiter = RateLimiter(reserve = 50, maxWait = 1, minInterval = 0)
+	limiter.limit = limit
+	limiter.remaining = remaining
+	limiter.resetAt = time() + 3600
+	return limiter
+
+# Requests answered with a 304 don't count against the budget, so only the responses get to say what's left
+def testAcquireLeavesBudgetToResponses():
+	limiter = limiterWithBudget(4000)
+	for _ in range(10):
+		limiter.acquire()
+	assert limiter.budget()[1] == 4000
+
+def testWebhookWorkCanUseReserve():
+	limiter = limiterWithBudget(50)
+	with pytest.raises(RateLimitExceeded):
+		limiter.acquire()
+	priority = requestPriority.set(Priority.webhook)
+	try:
+		limiter.acquire()
+	finally:
+		requestPriority.reset(priority)
+
+# Work handed off to an executor must keep the priority of whatever handed it off, even with it all going at once
+def testExecutorKeepsRequestPriority():
+	barrier = Barrier(4)
+	def priorityOnThread(_):
+		barrier.wait(timeout = 5)
+		return requestPriority.get()
+
+	priority = requestPriority.set(Priority.webhook)
+	try:
+		with ThreadPoolExecutor(max_workers = 4) as executor:
+			priorities = list(executor.map(withRequestPriority(priorityOnThread), range(4)))
+	finally:
+		requestPriority.reset(priority)
+	assert priorities == [Priority.webhook] * 4
+
+class BlockedSync:
+	def __init__(self) -> None:
+		self.syncing = Event()
+		self.unblock = Event()
+
+	def updateReleases(self, db, full: bool = False) -> bool:
+		self.syncing.set()
+		self.unblock.wait(timeout = 5)
+		return False
+
+class WebhookQueueStub:
+	def __init__(self) -> None:
+		self.drained = Event()
+
+	def drain(self) -> int:
+		self.drained.set()
+		return 0
+
+# The webhook queue must keep being processed while a (potentially long) sync is underway
+def testWebhooksDrainDuringSync(app, db, tmp_path):
+	gitHubAPI = BlockedSync()
+	webhookQueue = WebhookQueueStub()
+	releaseSync = ReleaseSync(
+		app, db, gitHubAPI, tmp_path / 'release-sync.lock', 3600, 86400, webhookQueue, 0.01, lambda: None
+	)
+	releaseSync.start()
+	try:
+		assert gitHubAPI.syncing.wait(timeout = 5)
+		webhookQueue.drained.clear()
+		assert webhookQueue.drained.wait(timeout = 5)
+	finally:
+		gitHubAPI.unblock.set()
@@ -0,0 +1,70 @@
+# SPDX-License-Identifier: BSD-3-Clause
+from io import BytesIO
+from zipfile import ZipFile
+import pytest
+
+from summon.remoteFile import RemoteFile, readAheadSize, tailSize
+
+# Stands in for a response from the server for a Range request
+class FakeResponse:
+	def __init__(self, statusCode: int, content: bytes, headers: dict[str, str]) -> None:
+		self.status_code = statusCode
+		self.content = content
+		self.headers = headers
+		self.url = 'https://example.com/archive.zip'
+
+	def raise_for_status(self):
+		pass
+
+# Stands in for a session talking to a server holding a file, which answers Range requests - optionally getting
+# them wrong by sending back the span asked for shifted along by some amount and/or cut short
+class FakeSession:
+	def __init__(self, data: bytes, shift: int = 0, shortBy: int = 0) -> None:
+		self.data = data
+		self.shift = shift
+		self.shortBy = shortBy
+		self.requests = 0
+
+	def get(self, uri: str, headers: dict[str, str], **kwargs) -> FakeResponse:
+		self.requests += 1
+		start, _, end = headers['Range'].removeprefix('bytes=').partition('-')
+		if start == '':
+			start = len(self.data) - int(end)
+			end = len(self.data) - 1
+		else:
+			start = int(start) + self.shift
+			end = min(int(end) + self.shift, len(self.data) - 1) - self.shortBy
+		return FakeResponse(
+			206, self.data[start:end + 1], {'Content-Range': f'bytes {start}-{end}/{len(self.data)}'}
+		)
+
+	def openRemote(self) -> RemoteFile:
+		response = self.get('', {'Range': f'bytes=-{tailSize}'})
+		remoteFile = RemoteFile.fromTailResponse(self, response)
+		assert remoteFile is not None
+		return remoteFile
+
+def makeArchive() -> bytes:
+	archive = BytesIO()
+	with ZipFile(archive, 'w') as zipFile:
+		zipFile.writestr('blackmagic-bmda', bytes(range(256)) * 1024)
+		zipFile.writestr('README.md', 'hello')
+	return archive.getvalue()
+
+def testReadsArchiveRemotely():
+	data = makeArchive()
+	with ZipFile(FakeSession(data).openRemote()) as zipFile:
+		assert zipFile.read('blackmagic-bmda') == bytes(range(256)) * 1024
+		assert zipFile.read('README.md') == b'hello'
+
+def testRejectsMisalignedSpan():
+	data = makeArchive()
+	remoteFile = FakeSession(data, shift = 16).openRemote()
+	with pytest.raises(OSError):
+		remoteFile.read(64)
+
+def testRejectsShortSpan():
+	data = makeArchive()
+	remoteFile = FakeSession(data, shortBy = 10).openRemote()
+	with pytest.raises(OSError):
+		remoteFile.read(readAheadSize)
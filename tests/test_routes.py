@@ -0,0 +1,65 @@
+# SPDX-License-Identifier: BSD-3-Clause
+import json
+import pytest
+
+from summon import cache
+from summon.snapshot import writeSnapshot
+from summon.types import Probe
+from .fixtures import addReleases
+
+def testMetadataFilters(db, client):
+	addReleases(db, 3)
+	response = client.get('/metadata.json?probe=native&os=linux&arch=amd64&latest=2')
+	assert response.status_code == 200
+	releases = response.json['releases']
+	assert list(releases) == ['v1.2.0', 'v1.1.0']
+	assert list(releases['v1.2.0']['firmware']) == ['native']
+	assert list(releases['v1.2.0']['bmda']) == ['linux']
+	assert list(releases['v1.2.0']['bmda']['linux']) == ['amd64']
+
+def testMetadataRejectsBadFilters(db, client):
+	addReleases(db, 1)
+	assert client.get('/metadata.json?os=beos').status_code == 400
+	assert client.get('/metadata.json?arch=vax').status_code == 400
+	assert client.get('/metadata.json?latest=0').status_code == 400
+	assert client.get('/metadata.json?latest=-1').status_code == 400
+	assert client.get('/metadata.json?latest=many').status_code == 400
+	assert client.get('/metadata.json?probe=nonsense').status_code == 400
+
+# Asking for the same thing different ways must land on the same cache entry rather than each building their own
+@pytest.mark.parametrize(('query', 'equivalentQuery'), (
+	('probe=stlink', 'probe=stlinkv2'),
+	('latest=1', 'latest=01'),
+	('arch=amd64', 'arch=x86_64'),
+	('minVersion=v1.1.0', 'minVersion=1.1'),
+))
+def testEquivalentFiltersShareCacheEntry(db, client, query, equivalentQuery):
+	addReleases(db, 2, probes = (Probe.native, Probe.stlink))
+	misses = cache.misses['metadata']
+	first = client.get(f'/metadata.json?{query}')
+	second = client.get(f'/metadata.json?{equivalentQuery}')
+	assert first.status_code == second.status_code == 200
+	assert first.data == second.data
+	assert cache.misses['metadata'] == misses + 1
+
+def testMetadataRejectsBadVersions(db, client):
+	addReleases(db, 1)
+	assert client.get('/metadata.json?minVersion=nonsense').status_code == 400
+	assert client.get('/metadata.json?minVersion=v1.0.0junk').status_code == 400
+	assert client.get('/metadata.json?minVersion=v1.0.0').status_code == 200
+
+# The releases have to reach clients newest first, both from the endpoints and in the snapshot of the metadata
+def testMetadataNewestFirst(db, client, tmp_path):
+	addReleases(db, 11)
+	newestFirst = [f'v1.{minor}.0' for minor in range(10, -1, -1)]
+	assert list(client.get('/metadata.json').json['releases']) == newestFirst
+	assert list(client.get('/metadata.json?latest=3').json['releases']) == newestFirst[:3]
+	writeSnapshot(db, tmp_path)
+	assert list(json.loads((tmp_path / 'metadata.json').read_bytes())['releases']) == newestFirst
+
+# Asking for more of the latest releases than the database can take as a limit gets all of them
+def testMetadataLatestClamped(db, client):
+	addReleases(db, 2)
+	response = client.get('/metadata.json?latest=99999999999999999999')
+	assert response.status_code == 200
+	assert list(response.json['releases']) == ['v1.1.0', 'v1.0.0']
@@ -0,0 +1,152 @@
+# SPDX-License-Identifier: BSD-3-Clause
+from sqlalchemy import sql
+from threading import Thread
+from time import sleep
+import pytest
+
+from summon.github import releasesPageURI, releasesPerPage
+from summon.models import Release, SyncState
+
+from .fakeGitHub import FakeGitHub, FakeResponse, releaseListing
+from .fixtures import countStatements
+
+def indexedVersions(db) -> set[str]:
+	return set(db.session.scalars(sql.select(Release.version)))
+
+def testIncrementalSyncFindsNewReleases(db):
+	gitHub = FakeGitHub()
+	api = gitHub.api()
+	gitHub.releases = [releaseListing(10, 'v1.0.0', '2024-01-01T00:00:00Z')]
+	assert api.updateReleases(db)
+	gitHub.releases.insert(0, releaseListing(20, 'v1.1.0', '2024-02-01T00:00:00Z'))
+	assert api.updateReleases(db)
+	assert indexedVersions(db) == {'v1.0.0', 'v1.1.0'}
+	assert db.session.scalar(sql.select(SyncState)).newestPublishedAt == '2024-02-01T00:00:00Z'
+	# Nothing new, nothing changed
+	assert not api.updateReleases(db)
+
+# A release drafted before the newest release we've seen, but published after it, has an older ID and sits further
+# down the list than that release - the incremental sync must still find it
+def testIncrementalSyncFindsDraftPublishedLate(db):
+	gitHub = FakeGitHub()
+	api = gitHub.api()
+	gitHub.releases = [
+		releaseListing(30, 'v1.2.0', '2024-03-01T00:00:00Z'),
+		releaseListing(25, 'v2.0.0', None),
+		releaseListing(20, 'v1.1.0', '2024-02-01T00:00:00Z'),
+		releaseListing(10, 'v1.0.0', '2024-01-01T00:00:00Z'),
+	]
+	api.updateReleases(db, full = True)
+	assert indexedVersions(db) == {'v1.0.0', 'v1.1.0', 'v1.2.0'}
+
+	# Now the draft gets published
+	gitHub.releases[1] = releaseListing(25, 'v2.0.0', '2024-04-01T00:00:00Z')
+	assert api.updateReleases(db)
+	assert 'v2.0.0' in indexedVersions(db)
+	syncState = db.session.scalar(sql.select(SyncState))
+	assert syncState.newestPublishedAt == '2024-04-01T00:00:00Z'
+	assert syncState.newestReleaseID == 25
+
+# Each page of the releases list must be read in full and closed as soon as it's been fetched, rather than being left
+# holding a connection open until the releases on it get indexed
+def testFullSyncClosesPages(db):
+	gitHub = FakeGitHub()
+	api = gitHub.api()
+	gitHub.releases = [
+		releaseListing(releaseID, f'v1.{releaseID}.0', '2024-01-01T00:00:00Z') for releaseID in range(250, 0, -1)
+	]
+	pages: dict[int, FakeResponse] = {}
+	get = gitHub.get
+	def getPage(uri: str, headers = None, **kwargs) -> FakeResponse:
+		response = get(uri, headers, **kwargs)
+		pages[int(uri.rpartition('page=')[2])] = response
+		return response
+	gitHub.get = getPage
+
+	count = 0
+	for release in api.fetchReleases(db, SyncState()):
+		assert pages[count // releasesPerPage + 1].closed
+		count += 1
+	assert count == 250
+
+def testFailedRequestClosed(db):
+	gitHub = FakeGitHub()
+	api = gitHub.api()
+	failure = FakeResponse(500)
+	gitHub.get = lambda uri, headers = None, **kwargs: failure
+	with pytest.raises(RuntimeError):
+		api.updateReleases(db)
+	assert failure.closed
+
+# A full reconciliation is there to pick up anything missing from the index, so it can't skip pages just because
+# GitHub says they haven't changed since we last fetched them
+def testFullSyncIgnoresValidators(db):
+	gitHub = FakeGitHub()
+	api = gitHub.api()
+	gitHub.releases = [
+		releaseListing(releaseID, f'v1.{releaseID}.0', '2024-01-01T00:00:00Z') for releaseID in range(150, 0, -1)
+	]
+	assert api.updateReleases(db, full = True)
+	# With nothing changed, an incremental sync gets told so and does nothing
+	assert not api.updateReleases(db)
+	assert gitHub.responses[-1].status_code == 304
+
+	# Now have a release on the second page go missing from the index
+	db.session.delete(db.session.scalar(sql.select(Release).where(Release.version == 'v1.1.0')))
+	db.session.commit()
+	assert api.updateReleases(db, full = True)
+	assert 'v1.1.0' in indexedVersions(db)
+
+# When GitHub says nothing has changed, the sync mustn't go through the release index at all
+def testUnchangedSyncSkipsIndex(db):
+	gitHub = FakeGitHub()
+	api = gitHub.api()
+	gitHub.releases = [releaseListing(10, 'v1.0.0', '2024-01-01T00:00:00Z')]
+	assert api.updateReleases(db)
+	with countStatements(db) as statements:
+		assert not api.updateReleases(db)
+	assert gitHub.responses[-1].status_code == 304
+	assert not any('FROM release' in statement for statement in statements)
+
+# Webhook notifications are processed alongside the sync, and if one gets a release indexed that the sync is also
+# about to index, the sync still has to go through with everything else rather than fail on the duplicate
+def testSyncToleratesReleaseIndexedByWebhook(app, db):
+	gitHub = FakeGitHub()
+	api = gitHub.api()
+	gitHub.releases = [
+		releaseListing(releaseID, f'v1.{releaseID}.0', '2024-01-01T00:00:00Z') for releaseID in range(150, 0, -1)
+	]
+	# Have a notification about a release on the second page get processed once the sync has got going
+	get = gitHub.get
+	def getPage(uri: str, headers = None, **kwargs) -> FakeResponse:
+		if uri == releasesPageURI(2):
+			def processWebhook():
+				with app.app_context():
+					api.processReleaseJobs(db, [{'action': 'published', 'release': gitHub.releases[-1]}])
+			thread = Thread(target = processWebhook)
+			thread.start()
+			thread.join()
+		return get(uri, headers, **kwargs)
+	gitHub.get = getPage
+
+	assert api.updateReleases(db, full = True)
+	assert len(db.session.scalars(sql.select(Release.version)).all()) == 150
+	assert 'v1.1.0' in indexedVersions(db)
+
+# However long the list of releases gets, only a few pages of it may be fetched ahead of the release being indexed
+def testFullSyncBoundsPagesInFlight(db):
+	gitHub = FakeGitHub()
+	api = gitHub.api()
+	gitHub.releases = [
+		releaseListing(releaseID, f'v1.{releaseID}.0', '2024-01-01T00:00:00Z') for releaseID in range(2000, 0, -1)
+	]
+	count = 0
+	for release in api.fetchReleases(db, SyncState()):
+		page = count // releasesPerPage + 1
+		# Take a while over the first release of each page, as indexing a release with new assets would
+		if count % releasesPerPage == 0:
+			sleep(0.05)
+		assert len(gitHub.responses) <= page + api.maxConcurrentRequests
+		count += 1
+	assert count == 2000
+	assert len(gitHub.responses) == 20
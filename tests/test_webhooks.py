@@ -0,0 +1,71 @@
+# SPDX-License-Identifier: BSD-3-Clause
+from sqlalchemy import sql
+import json
+import pytest
+
+from summon import webhooks
+from summon.models import WebhookJob
+from summon.webhooks import WebhookQueue
+
+# Stand in for the clock the queue goes by, so tests can say exactly when each thing happens
+class Clock:
+	def __init__(self) -> None:
+		self.now = 1000000.0
+
+	def __call__(self) -> float:
+		return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+	clock = Clock()
+	monkeypatch.setattr(webhooks, 'time', clock)
+	return clock
+
+@pytest.fixture
+def queue(app, db):
+	return WebhookQueue(app, db, None, lambda versions: None)
+
+def enqueue(queue: WebhookQueue, deliveryID: str, releaseID: int) -> bool:
+	webhookRequest = {'action': 'edited', 'release': {'id': releaseID}}
+	return queue.enqueue(deliveryID, webhookRequest, json.dumps(webhookRequest))
+
+def jobsDueAt(db) -> dict[str, float]:
+	return {job.deliveryID: job.dueAt for job in db.session.scalars(sql.select(WebhookJob))}
+
+def testNotificationsDebounced(db, queue, clock):
+	assert enqueue(queue, 'first', 1)
+	clock.now += 5
+	assert enqueue(queue, 'second', 1)
+	assert not enqueue(queue, 'second', 1)
+	# Both wait until things have been quiet for the debounce window after the second
+	assert set(jobsDueAt(db).values()) == {clock.now + webhooks.debounceWindow}
+
+# A release getting a notification every few seconds must not keep all of them held back forever
+def testDebounceIsCapped(db, queue, clock):
+	createdAt = clock.now
+	for delivery in range(20):
+		assert enqueue(queue, f'delivery{delivery}', 1)
+		clock.now += webhooks.debounceWindow / 2
+	assert max(jobsDueAt(db).values()) == createdAt + webhooks.maxDebounce
+
+	# Once that's up, the whole burst gets claimed together
+	clock.now = createdAt + webhooks.maxDebounce
+	jobs = queue.claimNextJobs()
+	assert len(jobs) == 20
+
+def testClaimOnlyPicksUpClaimedJobs(db, queue, clock):
+	assert enqueue(queue, 'first', 1)
+	assert enqueue(queue, 'second', 1)
+	assert enqueue(queue, 'other', 2)
+	# Have one of the release's jobs held back to exactly when the claim's lease will run out
+	clock.now += webhooks.debounceWindow
+	db.session.execute(
+		sql.update(WebhookJob).where(WebhookJob.deliveryID == 'second').values(dueAt = clock.now + webhooks.jobLease)
+	)
+	db.session.commit()
+
+	jobs = queue.claimNextJobs()
+	assert [job.deliveryID for job in jobs] == ['first']
+	jobs = queue.claimNextJobs()
+	assert [job.deliveryID for job in jobs] == ['other']
+	assert queue.claimNextJobs() == []